@@ -0,0 +1,160 @@
+import logging
+import socket
+from typing import Optional
+
+from mqtt_listeners import Listener
+
+logger = logging.getLogger(__name__)
+
+# 응답 끝 표시 (응답 본문 뒤에 단독 줄로 전송)
+RESPONSE_END = b'\n.\n'
+
+class AdminListener(Listener):
+    """실행 중인 서버를 점검하는 관리용 텍스트 명령 리스너 (기본: 127.0.0.1:1884)
+
+    한 줄에 명령 하나를 보내면 응답 본문과 '.' 한 줄을 돌려준다.
+    인증이 없으므로 외부에 노출되지 않는 주소에서만 연다.
+    알 수 없는 줄(예: 브라우저가 보낸 HTTP 요청)을 받으면 응답 없이 연결을 끊는다.
+    """
+
+    kind = 'admin'
+    handles_mqtt = False
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 1884, **kwargs):
+        super().__init__(host, port, **kwargs)
+
+    def serve(self, client_socket, server):
+        """명령 처리 루프 (클라이언트 스레드에서 실행)"""
+        try:
+            with client_socket.makefile('rb') as reader:
+                for line in reader:
+                    command = line.decode('utf-8', 'replace').strip()
+                    if not command:
+                        continue
+                    if command in ('quit', 'exit'):
+                        break
+                    response = self.execute(server, command)
+                    if response is None:
+                        logger.error(f"알 수 없는 관리 명령, 연결 종료: {command[:40]!r}")
+                        break
+                    client_socket.sendall(response.encode('utf-8') + RESPONSE_END)
+        except OSError as e:
+            logger.error(f"관리 연결 오류: {e}")
+        finally:
+            client_socket.close()
+
+    def execute(self, server, command: str) -> Optional[str]:
+        """명령 한 줄 실행 (알 수 없는 명령이면 None)"""
+        words = command.split()
+        handler = getattr(self, f"command_{words[0]}", None)
+        if handler is None:
+            return None
+        logger.info(f"관리 명령: {command}")
+        try:
+            return handler(server, words[1:])
+        except (ValueError, IndexError) as e:
+            return f"오류: {e}"
+
+    def command_help(self, server, args) -> str:
+        return '\n'.join([
+            "status                      서버 상태",
+            "trace                       단계별 지연 시간 통계 (read/decode/match/enqueue/write)",
+            "trace rate <N>              N개 메시지마다 1개 추적 (0 = 끄기)",
+            "trace reset                 통계 초기화",
+            "profile start [간격ms]      모든 스레드 샘플링 프로파일 시작",
+            "profile stop                프로파일 중지",
+            "profile dump [개수]         프로파일 결과 출력",
+            "snapshot save               영속 세션 구독과 보관 메시지를 설정된 스냅샷 경로에 저장",
+            "quit                        연결 종료",
+        ])
+
+    def command_status(self, server, args) -> str:
+        return '\n'.join([
+            f"클라이언트: {len(server.clients)}",
+            f"구독 필터: {len(server.subscriptions)}",
+            f"오프라인 세션: {len(server.offline_store.queues)}",
+            f"보관 메시지: {len(server.retained)}",
+            f"브리지 링크: {len(server.bridges)}",
+            "리스너: " + ', '.join(listener.name for listener in server.listeners),
+        ])
+
+    def command_trace(self, server, args) -> str:
+        tracer = server.tracer
+        action = args[0] if args else 'stats'
+        if action == 'rate':
+            tracer.set_rate(int(args[1]))
+            return f"샘플링 비율: {'꺼짐' if not tracer.sample_rate else f'1/{tracer.sample_rate}'}"
+        if action == 'reset':
+            tracer.reset()
+            return "추적 통계를 초기화했습니다"
+        if action == 'stats':
+            return tracer.format_stats()
+        raise ValueError(f"알 수 없는 trace 하위 명령: {action}")
+
+    def command_profile(self, server, args) -> str:
+        profiler = server.profiler
+        action = args[0] if args else 'dump'
+        if action == 'start':
+            if profiler.running:
+                return "프로파일이 이미 실행 중입니다"
+            profiler.start(float(args[1]) / 1000 if len(args) > 1 else None)
+            return f"프로파일 시작 (간격 {profiler.interval * 1000:.1f}ms)"
+        if action == 'stop':
+            profiler.stop()
+            return profiler.format_report(limit=0).splitlines()[0]
+        if action == 'dump':
+            return profiler.format_report(int(args[1]) if len(args) > 1 else 20)
+        raise ValueError(f"알 수 없는 profile 하위 명령: {action}")
+
+    def command_snapshot(self, server, args) -> str:
+        # 관리 연결에서 임의 경로에 쓰지 않도록 서버에 설정된 경로에만 저장
+        if args != ['save']:
+            raise ValueError("사용법: snapshot save")
+        path = server.snapshot_path
+        if not path:
+            raise ValueError("스냅샷 경로가 설정되지 않았습니다")
+        saved = server.save_snapshot(path)
+        if saved is None:
+            return f"스냅샷 저장 실패: {path}"
+        return f"스냅샷 저장: {path} (세션 {saved[0]}개, 보관 메시지 {saved[1]}개)"
+
+def admin_command(command: str, host: str = '127.0.0.1', port: int = 1884,
+                  timeout: float = 30.0) -> str:
+    """관리 리스너에 명령 하나를 보내고 응답 반환 (알 수 없는 명령이면 서버가 끊으므로 빈 문자열)"""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(command.encode('utf-8') + b'\n')
+        response = bytearray()
+        while not response.endswith(RESPONSE_END):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response.extend(chunk)
+    if not response.endswith(RESPONSE_END):
+        return ''
+    return bytes(response[:-len(RESPONSE_END)]).decode('utf-8', 'replace')
+
+def main():
+    """대화형 관리 콘솔"""
+    host = input("서버 주소를 입력하세요 (기본값: 127.0.0.1): ").strip() or '127.0.0.1'
+    try:
+        port = int(input("관리 포트를 입력하세요 (기본값: 1884): ").strip() or "1884")
+    except ValueError:
+        port = 1884
+    print("명령을 입력하세요 ('help' 참고, 종료: quit)")
+    while True:
+        try:
+            command = input("admin> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+        if not command:
+            continue
+        if command in ('quit', 'exit'):
+            break
+        try:
+            print(admin_command(command, host, port) or "알 수 없는 명령입니다 ('help' 참고)")
+        except OSError as e:
+            print(f"관리 명령 전송 실패: {e}")
+
+if __name__ == "__main__":
+    main()
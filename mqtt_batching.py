@@ -0,0 +1,225 @@
+import logging
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    # Python 3.14+ 표준 라이브러리 zstd (없으면 zlib로 대체)
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+# 배치 구독 필터 접두사: $batch/<간격ms>/<최대 개수>/<코덱>/<토픽 필터>
+BATCH_PREFIX = '$batch/'
+# 배치 프레임을 전달하는 토픽 (프레임 안에 각 메시지의 원래 토픽이 들어 있음)
+BATCH_TOPIC = '$batch'
+
+# 프레임 헤더: 매직, 버전, 코덱, 메시지 수 / 항목 헤더: 토픽 길이, 페이로드 길이
+BATCH_MAGIC = b'MQTB'
+BATCH_VERSION = 1
+BATCH_HEADER = struct.Struct('>4sBBI')
+BATCH_ENTRY_HEADER = struct.Struct('>HI')
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_IDS = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+MAX_BATCH_INTERVAL_MS = 60000
+MAX_BATCH_COUNT = 65535
+
+class BatchSpec:
+    """배치 구독 하나의 설정"""
+
+    __slots__ = ('subscription', 'topic_filter', 'interval', 'max_count', 'codec')
+
+    def __init__(self, subscription: str, topic_filter: str, interval: float,
+                 max_count: int, codec: int):
+        self.subscription = subscription
+        self.topic_filter = topic_filter
+        self.interval = interval
+        self.max_count = max_count
+        self.codec = codec
+
+def batch_filter(topic_filter: str, interval_ms: int = 100, max_count: int = 500,
+                 codec: str = 'zlib') -> str:
+    """배치 구독 필터 문자열 구성"""
+    return f"{BATCH_PREFIX}{interval_ms}/{max_count}/{codec}/{topic_filter}"
+
+def parse_batch_filter(subscription: str) -> Optional[BatchSpec]:
+    """배치 구독 필터 해석 (일반 필터면 None, 형식이 잘못되면 ValueError)
+
+    서버에서 쓸 수 없는 코덱을 요청하면 zlib로 대체한다.
+    프레임 헤더에 실제 코덱이 기록되므로 클라이언트는 그대로 해제할 수 있다.
+    """
+    if not subscription.startswith(BATCH_PREFIX):
+        return None
+    parts = subscription[len(BATCH_PREFIX):].split('/', 3)
+    if len(parts) != 4 or not parts[3]:
+        raise ValueError(f"배치 구독 형식 오류: {subscription}")
+    interval_ms, max_count, codec_name, topic_filter = parts
+    try:
+        interval_ms = int(interval_ms)
+        max_count = int(max_count)
+    except ValueError:
+        raise ValueError(f"배치 간격/개수는 정수여야 합니다: {subscription}") from None
+    if not 1 <= interval_ms <= MAX_BATCH_INTERVAL_MS or not 1 <= max_count <= MAX_BATCH_COUNT:
+        raise ValueError(f"배치 간격/개수 범위 오류: {subscription}")
+    if topic_filter.startswith(BATCH_PREFIX):
+        raise ValueError(f"중첩된 배치 구독: {subscription}")
+    codec = CODEC_IDS.get(codec_name)
+    if codec is None or (codec == CODEC_ZSTD and zstd is None):
+        logger.info(f"지원하지 않는 배치 코덱 {codec_name}, zlib 사용: {subscription}")
+        codec = CODEC_ZLIB
+    return BatchSpec(subscription, topic_filter, interval_ms / 1000, max_count, codec)
+
+def encode_batch(entries: List[Tuple[bytes, bytes]], codec: int = CODEC_ZLIB,
+                 level: int = 6) -> bytes:
+    """(토픽, 페이로드) 목록을 배치 프레임으로 인코딩"""
+    parts = []
+    for topic, payload in entries:
+        parts.append(BATCH_ENTRY_HEADER.pack(len(topic), len(payload)))
+        parts.append(topic)
+        parts.append(payload)
+    data = b''.join(parts)
+    if codec == CODEC_ZLIB:
+        data = zlib.compress(data, level)
+    elif codec == CODEC_ZSTD:
+        data = zstd.compress(data)
+    return BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, codec, len(entries)) + data
+
+def decode_batch(frame: bytes) -> List[Tuple[str, bytes]]:
+    """배치 프레임을 (토픽, 페이로드) 목록으로 디코딩"""
+    magic, version, codec, count = BATCH_HEADER.unpack_from(frame, 0)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError("배치 프레임이 아닙니다")
+    data = bytes(frame[BATCH_HEADER.size:])
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    elif codec == CODEC_ZSTD:
+        if zstd is None:
+            raise ValueError("zstd 코덱을 사용할 수 없습니다")
+        data = zstd.decompress(data)
+    elif codec != CODEC_NONE:
+        raise ValueError(f"알 수 없는 배치 코덱: {codec}")
+
+    entries = []
+    offset = 0
+    view = memoryview(data)
+    for _ in range(count):
+        topic_length, payload_length = BATCH_ENTRY_HEADER.unpack_from(data, offset)
+        offset += BATCH_ENTRY_HEADER.size
+        topic = str(view[offset:offset + topic_length], 'utf-8')
+        offset += topic_length
+        entries.append((topic, bytes(view[offset:offset + payload_length])))
+        offset += payload_length
+    return entries
+
+class PendingBatch:
+    """클라이언트/배치 구독별로 모으는 중인 메시지"""
+
+    __slots__ = ('client_id', 'spec', 'messages', 'size', 'deadline')
+
+    def __init__(self, client_id: str, spec: BatchSpec, deadline: float):
+        self.client_id = client_id
+        self.spec = spec
+        self.messages = []
+        self.size = 0
+        self.deadline = deadline
+
+class Batcher:
+    """배치 구독 메시지를 모아 간격/개수/크기 한도마다 한 프레임으로 전달
+
+    개수·크기 한도를 채운 배치는 발행 스레드에서 바로 보내고,
+    간격이 지난 배치는 하나의 플러시 스레드가 보낸다.
+    """
+
+    def __init__(self, deliver, max_frame_bytes: int = 256 * 1024, compression_level: int = 6):
+        # deliver(client_id, frame): 프레임을 구독자에게 전달 (서버가 제공)
+        self.deliver = deliver
+        self.max_frame_bytes = max_frame_bytes
+        self.compression_level = compression_level
+        self.pending: Dict[Tuple[str, str], PendingBatch] = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.frames = 0
+        self.batched_messages = 0
+
+    def add(self, spec: BatchSpec, client_ids, message):
+        """배치 구독자들에게 보낼 메시지 추가"""
+        size = len(message.payload) + len(message.topic.encoded)
+        full = []
+        with self.condition:
+            for client_id in client_ids:
+                key = (client_id, spec.subscription)
+                batch = self.pending.get(key)
+                if batch is None:
+                    batch = self.pending[key] = PendingBatch(
+                        client_id, spec, time.monotonic() + spec.interval)
+                    self.condition.notify()
+                batch.messages.append(message)
+                batch.size += size
+                if len(batch.messages) >= spec.max_count or batch.size >= self.max_frame_bytes:
+                    full.append(self.pending.pop(key))
+            if not self.running:
+                self.start()
+        for batch in full:
+            self.flush(batch)
+
+    def discard(self, client_id: str, subscription: str):
+        """구독 해제된 배치의 대기 메시지 버리기"""
+        with self.condition:
+            self.pending.pop((client_id, subscription), None)
+
+    def start(self):
+        """플러시 스레드 시작 (condition 잠금 안에서 호출)"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='batch-flusher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """플러시 스레드 중지 (대기 중인 배치는 버림)"""
+        with self.condition:
+            self.running = False
+            self.pending.clear()
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """간격이 지난 배치를 보내는 루프"""
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                due = [key for key, batch in self.pending.items() if batch.deadline <= now]
+                batches = [self.pending.pop(key) for key in due]
+                if not batches:
+                    next_deadline = min((batch.deadline for batch in self.pending.values()), default=None)
+                    self.condition.wait(None if next_deadline is None else next_deadline - now)
+                    continue
+            for batch in batches:
+                self.flush(batch)
+
+    def flush(self, batch: PendingBatch):
+        """배치를 프레임으로 인코딩해 전달 (만료된 메시지 제외)"""
+        try:
+            now = time.monotonic()
+            entries = [(message.topic.encoded[2:], message.payload)
+                       for message in batch.messages if not message.expired(now)]
+            if not entries:
+                return
+            frame = encode_batch(entries, batch.spec.codec, self.compression_level)
+            self.frames += 1
+            self.batched_messages += len(entries)
+            self.deliver(batch.client_id, frame)
+        except Exception as e:
+            logger.error(f"배치 전송 오류 ({batch.client_id}): {e}")
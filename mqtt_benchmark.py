@@ -0,0 +1,467 @@
+import gc
+import json
+import logging
+import os
+import resource
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from mqtt_batching import BATCH_TOPIC, batch_filter, decode_batch
+from mqtt_bridge import start_bridges
+from mqtt_listeners import TLSListener
+from mqtt_server_network import MQTTServer
+
+def encode_remaining_length(length: int) -> bytes:
+    """나머지 길이 인코딩"""
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length = length // 128
+        if length > 0:
+            byte |= 0x80
+        encoded.append(byte)
+        if length == 0:
+            return bytes(encoded)
+
+def encode_string(value: str) -> bytes:
+    """길이 접두 UTF-8 문자열 인코딩"""
+    data = value.encode('utf-8')
+    return len(data).to_bytes(2, 'big') + data
+
+class RawMQTTConnection:
+    """벤치마크용 최소 MQTT 클라이언트 (paho 없이 소켓으로 직접 통신)"""
+
+    def __init__(self, host: str, port: int, client_id: str, protocol_level: int = 4,
+                 ssl_context: ssl.SSLContext = None, tls_session: ssl.SSLSession = None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.protocol_level = protocol_level
+        self.ssl_context = ssl_context
+        self.tls_session = tls_session
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.next_message_id = 1
+        self.buffer = bytearray()
+
+    def send(self, packet_type: int, body: bytes):
+        self.socket.sendall(bytes([packet_type]) + encode_remaining_length(len(body)) + body)
+
+    def read_packet(self):
+        """패킷 하나 읽기 -> (패킷 타입, 플래그, 본문)"""
+        while True:
+            packet = self.parse_buffered()
+            if packet is not None:
+                return packet
+            chunk = self.socket.recv(65536)
+            if not chunk:
+                raise ConnectionError("연결이 끊어졌습니다")
+            self.buffer.extend(chunk)
+
+    def parse_buffered(self):
+        """수신 버퍼에 완성된 패킷이 있으면 꺼내기"""
+        buffer = self.buffer
+        multiplier = 1
+        length = 0
+        offset = 1
+        while True:
+            if offset >= len(buffer):
+                return None
+            byte = buffer[offset]
+            offset += 1
+            length += (byte & 0x7F) * multiplier
+            if (byte & 0x80) == 0:
+                break
+            multiplier *= 128
+        if len(buffer) < offset + length:
+            return None
+        first_byte = buffer[0]
+        body = bytes(buffer[offset:offset + length])
+        del buffer[:offset + length]
+        return first_byte >> 4, first_byte & 0x0F, body
+
+    def properties(self, data: bytes = b'') -> bytes:
+        """MQTT 5 속성 블록 (3.1.1에서는 빈 바이트)"""
+        if self.protocol_level != 5:
+            return b''
+        return encode_remaining_length(len(data)) + data
+
+    def connect(self, keep_alive: int = 60, properties: bytes = b'', clean_session: bool = True):
+        """CONNECT 전송 후 CONNACK 대기 -> CONNACK 본문"""
+        self.socket.connect((self.host, self.port))
+        if self.ssl_context is not None:
+            self.socket = self.ssl_context.wrap_socket(
+                self.socket, server_hostname=self.host, session=self.tls_session)
+        flags = 0x02 if clean_session else 0x00
+        body = encode_string("MQTT") + bytes([self.protocol_level, flags]) + keep_alive.to_bytes(2, 'big')
+        body += self.properties(properties) + encode_string(self.client_id)
+        self.send(0x10, body)
+        packet_type, _, body = self.read_packet()
+        if packet_type != 2:
+            raise ConnectionError(f"CONNACK 대신 {packet_type} 수신")
+        return body
+
+    def subscribe(self, topic_filter: str, qos: int = 0):
+        """SUBSCRIBE 전송 후 SUBACK 대기"""
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        self.send(0x82, message_id.to_bytes(2, 'big') + self.properties()
+                  + encode_string(topic_filter) + bytes([qos]))
+        packet_type, _, _ = self.read_packet()
+        if packet_type != 9:
+            raise ConnectionError(f"SUBACK 대신 {packet_type} 수신")
+
+    def publish(self, topic: str, payload: bytes, properties: bytes = b''):
+        """QoS 0 PUBLISH 전송"""
+        self.send(0x30, encode_string(topic) + self.properties(properties) + payload)
+
+    def close(self):
+        try:
+            self.socket.sendall(b'\xe0\x00')
+        except OSError:
+            pass
+        self.socket.close()
+
+def start_test_server(**kwargs):
+    """임의 포트의 로컬 서버를 백그라운드 스레드로 시작"""
+    server = MQTTServer(host='127.0.0.1', port=0, **kwargs)
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    while not server.running:
+        time.sleep(0.01)
+    return server, server.server_socket.getsockname()[1]
+
+def quiet_logging():
+    """벤치마크 중 연결/메시지 단위 로그 끄기"""
+    for name in ('mqtt_server_network', 'mqtt_offline_queue', 'mqtt_bridge', 'mqtt_listeners',
+                 'mqtt_batching', 'mqtt_snapshot'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+def memory_benchmark(connections: int = 1000):
+    """유휴 연결 하나당 메모리 사용량 측정"""
+    quiet_logging()
+    server, port = start_test_server()
+
+    # 클라이언트 쪽 소켓 객체는 측정에서 제외하도록 미리 생성
+    clients = [RawMQTTConnection('127.0.0.1', port, f"idle-{i}") for i in range(connections)]
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    for i, client in enumerate(clients):
+        client.connect()
+        client.subscribe(f"sensor/{i % 100}/temperature")
+
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.stop()
+
+    python_bytes = (after - before) / connections
+    rss_bytes = (rss_after - rss_before) * 1024 / connections
+    print(f"유휴 연결 수: {connections}")
+    print(f"연결당 Python 힙: {python_bytes:.0f} bytes")
+    print(f"연결당 RSS 증가 (스레드 스택 포함): {rss_bytes:.0f} bytes")
+    print(f"풀에 보관 중인 버퍼: "
+          f"{sum(len(free) for free in server.buffer_pool.free.values())}개")
+
+    for client in clients:
+        client.close()
+    server.stop()
+    return python_bytes
+
+def bridge_benchmark(nodes: int = 3, messages: int = 20000, payload_size: int = 64):
+    """로컬호스트 포트의 다중 노드 브리지 처리량 측정
+
+    노드마다 구독자 1개('bench/#')와 발행자 1개를 두고, 모든 발행자의 메시지가
+    모든 노드의 구독자에게 도착할 때까지의 전체 처리량을 잰다.
+    구독자가 없는 토픽('idle/...')은 피어로 전달되지 않아야 한다.
+    """
+    quiet_logging()
+    servers = [start_test_server() for _ in range(nodes)]
+    links = []
+    for index, (server, _) in enumerate(servers):
+        peers = [('127.0.0.1', port) for other, (_, port) in enumerate(servers) if other != index]
+        links.extend(start_bridges(server, f"node{index}", peers))
+    for link in links:
+        link.connected.wait(10)
+
+    subscribers = []
+    for index, (_, port) in enumerate(servers):
+        subscriber = RawMQTTConnection('127.0.0.1', port, f"bench-sub-{index}")
+        subscriber.connect()
+        subscriber.subscribe('bench/#')
+        subscribers.append(subscriber)
+
+    # 구독 요약이 모든 피어에 반영될 때까지 대기
+    bridge_ids = {f"$bridge/node{index}" for index in range(nodes)}
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        if all(len(server.subscriptions.get('bench/#', ()) & bridge_ids) == nodes - 1
+               for server, _ in servers):
+            break
+        time.sleep(0.01)
+
+    publishers = []
+    for index, (_, port) in enumerate(servers):
+        publisher = RawMQTTConnection('127.0.0.1', port, f"bench-pub-{index}")
+        publisher.connect()
+        publishers.append(publisher)
+
+    expected = nodes * messages
+    received = [0] * nodes
+
+    def receive(index):
+        subscriber = subscribers[index]
+        while received[index] < expected:
+            packet_type, _, _ = subscriber.read_packet()
+            if packet_type == 3:
+                received[index] += 1
+
+    def publish(index):
+        payload = b'x' * payload_size
+        publisher = publishers[index]
+        for _ in range(messages):
+            publisher.publish(f"bench/{index}", payload)
+            # 구독자가 없는 토픽은 브리지로 나가지 않아야 함
+            publisher.publish(f"idle/{index}", payload)
+
+    receivers = [threading.Thread(target=receive, args=(i,), daemon=True) for i in range(nodes)]
+    senders = [threading.Thread(target=publish, args=(i,), daemon=True) for i in range(nodes)]
+    start = time.perf_counter()
+    for thread in receivers + senders:
+        thread.start()
+    for thread in receivers:
+        thread.join(120)
+    elapsed = time.perf_counter() - start
+
+    delivered = sum(received)
+    forwarded = sum(link.received for link in links)
+    print(f"노드 수: {nodes}, 노드당 발행 메시지: {messages} (+ 구독자 없는 토픽 {messages})")
+    print(f"전달된 메시지: {delivered} / {nodes * expected}")
+    print(f"브리지로 전달된 메시지: {forwarded} (예상: {nodes * (nodes - 1) * messages})")
+    print(f"소요 시간: {elapsed:.2f}초, 전체 처리량: {delivered / elapsed:.0f} msg/s")
+
+    for link in links:
+        link.stop()
+    for client in subscribers + publishers:
+        client.close()
+    for server, _ in servers:
+        server.stop()
+    return delivered / elapsed
+
+def batching_benchmark(messages: int = 50000, interval_ms: int = 50, max_count: int = 1000):
+    """일반 구독과 배치 구독(zlib)의 수신 바이트/패킷 수 비교
+
+    continuous_pubsub과 같은 형태의 센서 JSON을 발행하고,
+    같은 필터를 일반 구독한 구독자와 배치 구독한 구독자가 받은 양을 비교한다.
+    """
+    quiet_logging()
+    server, port = start_test_server()
+    direct = RawMQTTConnection('127.0.0.1', port, 'bench-direct')
+    direct.connect()
+    direct.subscribe('sensor/#')
+    batched = RawMQTTConnection('127.0.0.1', port, 'bench-batched')
+    batched.connect()
+    batched.subscribe(batch_filter('sensor/#', interval_ms, max_count, 'zlib'))
+    publisher = RawMQTTConnection('127.0.0.1', port, 'bench-pub')
+    publisher.connect()
+
+    results = {}
+
+    def receive(label, subscriber, decode):
+        packets = 0
+        received_bytes = 0
+        count = 0
+        while count < messages:
+            packet_type, _, body = subscriber.read_packet()
+            if packet_type != 3:
+                continue
+            packets += 1
+            received_bytes += len(body) + 2
+            count += decode(body)
+        results[label] = (packets, received_bytes, time.perf_counter())
+
+    def count_batch(body):
+        topic_length = int.from_bytes(body[0:2], 'big')
+        if body[2:2 + topic_length].decode('utf-8') != BATCH_TOPIC:
+            return 0
+        return len(decode_batch(body[2 + topic_length:]))
+
+    receivers = [
+        threading.Thread(target=receive, args=("일반 구독", direct, lambda body: 1), daemon=True),
+        threading.Thread(target=receive, args=("배치 구독", batched, count_batch), daemon=True),
+    ]
+    for thread in receivers:
+        thread.start()
+    start = time.perf_counter()
+    for i in range(messages):
+        publisher.publish('sensor/temperature', json.dumps({
+            "temperature": round(20 + (i % 100) / 10, 1),
+            "unit": "celsius",
+            "timestamp": time.time(),
+            "source": "bench-pub",
+            "client_ip": "192.168.0.10",
+        }).encode('utf-8'))
+    for thread in receivers:
+        thread.join(120)
+
+    print(f"발행 메시지: {messages}, 배치 설정: {interval_ms}ms / {max_count}개 / zlib")
+    for label, (packets, received_bytes, finished) in results.items():
+        print(f"{label}: PUBLISH 패킷 {packets}개, 수신 {received_bytes / 1024:.0f} KiB, "
+              f"메시지당 {received_bytes / messages:.1f} bytes, 완료 {finished - start:.2f}초")
+    if len(results) == 2:
+        direct_packets, direct_bytes, _ = results["일반 구독"]
+        batch_packets, batch_bytes, _ = results["배치 구독"]
+        print(f"패킷 수 {direct_packets / batch_packets:.0f}배 감소, "
+              f"바이트 {direct_bytes / batch_bytes:.1f}배 감소")
+
+    for client in (direct, batched, publisher):
+        client.close()
+    server.stop()
+    return results
+
+def snapshot_benchmark(sessions: int = 20000, filters_per_session: int = 5, retained: int = 1000):
+    """스냅샷 복원 후 첫 CONNACK까지 걸리는 시간 (time-to-serve) 측정
+
+    영속 세션 sessions개 x 필터 filters_per_session개의 구독과 보관 메시지를 만들어
+    스냅샷으로 저장한 뒤, 새 서버가 스냅샷을 복원하고 연결을 받기까지의 시간을 잰다.
+    """
+    quiet_logging()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot.bin')
+
+        server = MQTTServer(host='127.0.0.1', port=0)
+        server.offline_store.restore(
+            (f"device-{i}", tuple(f"site/{i % 100}/device/{i}/{kind}" if kind != '#' else f"cmd/{i}/#"
+                                  for kind in ('temperature', 'humidity', 'status', 'config', '#')[:filters_per_session]),
+             None)
+            for i in range(sessions))
+        server.subscribe_many(
+            (queue.client_id, topic_filter)
+            for queue in list(server.offline_store.queues.values())
+            for topic_filter in queue.subscriptions)
+        for i in range(retained):
+            server.retain(server.topics.get(f"site/{i % 100}/device/{i}/status"), b'{"status": "online"}')
+        subscriptions = sum(len(subscribers) for subscribers in server.subscriptions.values())
+
+        start = time.perf_counter()
+        server.save_snapshot(path)
+        save_time = time.perf_counter() - start
+        server.offline_store.shutdown()
+
+        # 새 서버: 스냅샷 복원 -> 리스너 열기 -> 첫 CONNACK
+        start = time.perf_counter()
+        server, port = start_test_server(snapshot_path=path)
+        client = RawMQTTConnection('127.0.0.1', port, 'device-7')
+        connack = client.connect(clean_session=False)
+        time_to_serve = time.perf_counter() - start
+
+        # 복원된 세션으로 메시지가 전달되는지 확인
+        client.publish('site/7/device/7/temperature', b'21.5')
+        _, _, body = client.read_packet()
+        delivered = body.endswith(b'21.5')
+        client.close()
+        server.snapshot_path = None
+        server.stop()
+
+        print(f"구독: {subscriptions}개 (세션 {sessions}개), 보관 메시지: {retained}개")
+        print(f"스냅샷 크기: {os.path.getsize(path) / 1024:.0f} KiB, 저장 {save_time * 1000:.0f}ms")
+        print(f"복원 후 첫 CONNACK까지: {time_to_serve * 1000:.0f}ms "
+              f"(세션 유지: {bool(connack[0] & 0x01)}, 복원된 구독으로 전달: {delivered})")
+    return time_to_serve
+
+def generate_test_certificate(directory: str):
+    """openssl로 localhost용 자체 서명 인증서 생성 -> (인증서 경로, 키 경로)"""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-keyout', keyfile, '-out', certfile, '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+def tls_handshake_benchmark(connections: int = 300):
+    """TLS 핸드셰이크/초 측정 (세션 재개 사용/미사용 비교)"""
+    quiet_logging()
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = generate_test_certificate(directory)
+        client_context = ssl.create_default_context(cafile=certfile)
+
+        results = {}
+        for label, resume in (("전체 핸드셰이크", False), ("세션 재개", True)):
+            listener = TLSListener(certfile, keyfile, host='127.0.0.1', port=0, session_tickets=resume)
+            server, _ = start_test_server(listeners=[listener])
+
+            session = None
+            reused = 0
+            start = time.perf_counter()
+            for i in range(connections):
+                client = RawMQTTConnection('127.0.0.1', listener.port, f"tls-{i}",
+                                           ssl_context=client_context, tls_session=session)
+                # CONNACK을 읽는 동안 TLS 1.3 세션 티켓도 함께 수신됨
+                client.connect()
+                if client.socket.session_reused:
+                    reused += 1
+                if resume:
+                    session = client.socket.session
+                client.close()
+            elapsed = time.perf_counter() - start
+            server.stop()
+
+            # 서버 스레드가 핸드셰이크에 쓴 CPU 시간 기준 처리 가능한 핸드셰이크/초
+            cpu_per_handshake = listener.handshake_cpu_seconds / max(listener.handshakes, 1)
+            results[label] = 1 / cpu_per_handshake
+            print(f"{label}: 서버 CPU {cpu_per_handshake * 1000:.2f} ms/핸드셰이크 "
+                  f"(코어당 최대 {1 / cpu_per_handshake:.0f} 핸드셰이크/초), "
+                  f"종단 간 {connections / elapsed:.0f} 연결/초, 재개된 세션 {reused}/{connections}")
+
+    speedup = results["세션 재개"] / results["전체 핸드셰이크"]
+    print(f"세션 재개 효과 (서버 CPU 기준): {speedup:.2f}배")
+    return results
+
+def main():
+    """메인 함수"""
+    print("MQTT 서버 벤치마크")
+    print("=" * 40)
+    print("1. 유휴 연결당 메모리")
+    print("2. 다중 노드 브리지 처리량")
+    print("3. TLS 핸드셰이크 (세션 재개 비교)")
+    print("4. 배치 구독 (압축) 수신량 비교")
+    print("5. 스냅샷 복원 후 서비스 시작 시간")
+
+    choice = input("선택하세요 (1-5): ")
+
+    if choice == "1":
+        try:
+            connections = int(input("연결 수를 입력하세요 (기본값: 1000): ").strip() or "1000")
+        except ValueError:
+            connections = 1000
+        memory_benchmark(connections)
+    elif choice == "2":
+        try:
+            nodes = int(input("노드 수를 입력하세요 (기본값: 3): ").strip() or "3")
+        except ValueError:
+            nodes = 3
+        bridge_benchmark(nodes)
+    elif choice == "3":
+        tls_handshake_benchmark()
+    elif choice == "4":
+        batching_benchmark()
+    elif choice == "5":
+        snapshot_benchmark()
+    else:
+        print("잘못된 선택입니다.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import List
+
+from mqtt_server_network import (
+    BRIDGE_CLIENT_PREFIX,
+    MQTTServer,
+    read_properties,
+    setup_logging,
+)
+
+logger = logging.getLogger(__name__)
+
+# 한 SUBSCRIBE/UNSUBSCRIBE 패킷에 담는 최대 필터 수
+FILTERS_PER_PACKET = 1000
+
+def encode_string(value: str) -> bytes:
+    """길이 접두 UTF-8 문자열 인코딩"""
+    data = value.encode('utf-8')
+    return len(data).to_bytes(2, 'big') + data
+
+def encode_packet(first_byte: int, body: bytes) -> bytes:
+    """고정 헤더를 붙인 패킷 구성"""
+    header = bytearray([first_byte])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length = length // 128
+        if length > 0:
+            byte |= 0x80
+        header.append(byte)
+        if length == 0:
+            break
+    return bytes(header) + body
+
+class BridgeLink:
+    """다른 서버 노드로 가는 브리지 링크
+
+    링크는 피어에 MQTT 5 클라이언트로 접속해 이 노드의 로컬 구독 필터(구독 요약)를
+    그대로 구독한다. 따라서 피어는 이 노드에 구독자가 있는 메시지만 보내고,
+    받은 메시지는 이 노드의 로컬 구독자에게만 전달된다 (다른 피어로 재전달하지 않음).
+    모든 노드가 서로 링크를 맺는 풀 메시 구성을 가정한다.
+
+    구독 변경은 구독 잠금 안에서 송신 큐에 순서대로 넣기만 하고,
+    전송은 링크별 송신 스레드가 잠금 밖에서 한다.
+    """
+
+    def __init__(self, server: MQTTServer, node_id: str, host: str, port: int,
+                 keep_alive: int = 60, reconnect_interval: float = 2.0):
+        self.server = server
+        self.node_id = node_id
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.reconnect_interval = reconnect_interval
+        self.socket = None
+        self.write_lock = threading.Lock()
+        self.next_message_id = 1
+        self.running = False
+        self.connected = threading.Event()
+        self.received = 0
+        self.thread = None
+        # 구독 변경 송신 큐: (대상 소켓, 첫 바이트, 필터 목록, 구독 여부)
+        self.outbound = deque()
+        self.outbound_ready = threading.Condition()
+        self.sender = None
+
+    @property
+    def peer(self):
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        """링크 스레드 시작 (끊어지면 자동 재연결)"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.sender = threading.Thread(target=self.send_loop)
+        self.sender.daemon = True
+        self.sender.start()
+
+    def stop(self):
+        """링크 중지"""
+        self.running = False
+        self.server.detach_bridge(self)
+        with self.outbound_ready:
+            self.outbound.clear()
+            self.outbound_ready.notify()
+        self.close_socket()
+
+    def run(self):
+        """연결 유지 루프"""
+        while self.running:
+            try:
+                self.connect()
+                self.receive_loop()
+            except Exception as e:
+                if self.running:
+                    logger.error(f"브리지 {self.peer} 오류: {e}")
+            finally:
+                self.connected.clear()
+                self.server.detach_bridge(self)
+                self.close_socket()
+            if self.running:
+                time.sleep(self.reconnect_interval)
+
+    def connect(self):
+        """피어에 접속하고 구독 요약 전송"""
+        self.socket = socket.create_connection((self.host, self.port), timeout=10)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # MQTT 5 CONNECT (Clean Start, 빈 속성)
+        body = (encode_string("MQTT") + bytes([5, 0x02]) + self.keep_alive.to_bytes(2, 'big')
+                + b'\x00' + encode_string(BRIDGE_CLIENT_PREFIX + self.node_id))
+        self.socket.sendall(encode_packet(0x10, body))
+        packet_type, _, body = self.read_packet()
+        if packet_type != 2 or body[1] != 0:
+            raise ConnectionError("브리지 CONNACK 거부")
+
+        # 구독 요약을 보낸 뒤부터 구독 변경을 전달받음
+        self.server.attach_bridge(self, self.send_summary)
+        self.connected.set()
+        logger.info(f"브리지 연결: {self.node_id} -> {self.peer}")
+
+    def receive_loop(self):
+        """피어가 보낸 메시지를 로컬 구독자에게 전달"""
+        self.socket.settimeout(self.keep_alive / 2)
+        while self.running:
+            try:
+                packet_type, flags, body = self.read_packet()
+            except socket.timeout:
+                # Keep Alive 유지
+                self.send(b'\xc0\x00')
+                continue
+
+            if packet_type == 3:  # PUBLISH
+                self.handle_publish(flags, body)
+            elif packet_type == 14:  # DISCONNECT
+                raise ConnectionError("피어가 연결을 종료했습니다")
+
+    def handle_publish(self, flags: int, body: bytes):
+        """피어로부터 받은 PUBLISH 처리"""
+        topic_length = (body[0] << 8) | body[1]
+        offset = 2 + topic_length
+        topic = self.server.topics.lookup(body[2:offset])
+        qos = (flags >> 1) & 0x03
+        if qos > 0:
+            offset += 2
+        properties, offset = read_properties(body, offset)
+        self.received += 1
+        self.server.publish(topic, body[offset:], properties=properties, from_bridge=True)
+
+    def send_summary(self, filters: List[str]):
+        """로컬 구독 요약 전송 (연결할 때 구독 잠금 안에서 호출)
+
+        이전 연결에서 보내지 못한 변경은 요약에 모두 반영되므로 버린다.
+        """
+        with self.outbound_ready:
+            self.outbound.clear()
+        self.filters_added(filters)
+        logger.info(f"브리지 구독 요약 전송: {self.peer} ({len(filters)}개 필터)")
+
+    def filter_added(self, topic_filter: str):
+        """로컬 구독 필터 추가 알림 (구독 잠금 안에서 호출)"""
+        self.queue_filters(0x82, [topic_filter], subscribe=True)
+
+    def filters_added(self, filters: List[str]):
+        """여러 로컬 구독 필터 추가 알림 (구독 잠금 안에서 호출, 패킷당 FILTERS_PER_PACKET개)"""
+        for start in range(0, len(filters), FILTERS_PER_PACKET):
+            self.queue_filters(0x82, filters[start:start + FILTERS_PER_PACKET], subscribe=True)
+
+    def filter_removed(self, topic_filter: str):
+        """로컬 구독 필터 제거 알림 (구독 잠금 안에서 호출)"""
+        self.queue_filters(0xA2, [topic_filter], subscribe=False)
+
+    def queue_filters(self, first_byte: int, filters: List[str], subscribe: bool):
+        """SUBSCRIBE/UNSUBSCRIBE를 현재 연결의 송신 큐에 추가"""
+        if not filters:
+            return
+        with self.outbound_ready:
+            self.outbound.append((self.socket, first_byte, filters, subscribe))
+            self.outbound_ready.notify()
+
+    def send_loop(self):
+        """송신 큐의 구독 변경을 순서대로 전송 (송신 스레드)
+
+        전송에 실패하면 연결을 끊어 run()이 다시 연결하고 요약을 새로 보내게 한다.
+        """
+        while True:
+            with self.outbound_ready:
+                while self.running and not self.outbound:
+                    self.outbound_ready.wait()
+                if not self.running:
+                    return
+                sock, first_byte, filters, subscribe = self.outbound.popleft()
+            try:
+                with self.write_lock:
+                    # 큐에 넣은 뒤 재연결했으면 새 연결의 요약에 이미 반영됨
+                    if sock is None or self.socket is not sock:
+                        continue
+                    sock.sendall(self.encode_filters(first_byte, filters, subscribe))
+            except OSError as e:
+                logger.error(f"브리지 {self.peer} 구독 변경 전송 오류, 재연결합니다: {e}")
+                try:
+                    # 수신 스레드의 recv를 깨워 재연결 루프로 넘김
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def encode_filters(self, first_byte: int, filters: List[str], subscribe: bool) -> bytes:
+        """SUBSCRIBE/UNSUBSCRIBE 패킷 구성 (송신 스레드에서만 호출)"""
+        message_id = self.next_message_id
+        self.next_message_id = message_id % 65535 + 1
+        body = bytearray(message_id.to_bytes(2, 'big'))
+        body.append(0x00)  # 속성 길이
+        for topic_filter in filters:
+            body.extend(encode_string(topic_filter))
+            if subscribe:
+                # QoS 0, No Local 없음
+                body.append(0x00)
+        return encode_packet(first_byte, bytes(body))
+
+    def send(self, packet: bytes):
+        with self.write_lock:
+            if self.socket is not None:
+                self.socket.sendall(packet)
+
+    def recv_exact(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("연결이 끊어졌습니다")
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_packet(self):
+        """패킷 하나 읽기 -> (패킷 타입, 플래그, 본문)"""
+        first_byte = self.recv_exact(1)[0]
+        # 타임아웃은 패킷 경계에서만 처리하도록 나머지는 블로킹으로 읽음
+        timeout = self.socket.gettimeout()
+        self.socket.settimeout(None)
+        try:
+            multiplier = 1
+            length = 0
+            while True:
+                byte = self.recv_exact(1)[0]
+                length += (byte & 0x7F) * multiplier
+                if (byte & 0x80) == 0:
+                    break
+                multiplier *= 128
+            body = self.recv_exact(length)
+        finally:
+            self.socket.settimeout(timeout)
+        return first_byte >> 4, first_byte & 0x0F, body
+
+    def close_socket(self):
+        with self.write_lock:
+            if self.socket is not None:
+                try:
+                    self.socket.close()
+                except OSError:
+                    pass
+                self.socket = None
+
+def start_bridges(server: MQTTServer, node_id: str, peers) -> List[BridgeLink]:
+    """피어 목록 [(host, port), ...]으로 브리지 링크 시작"""
+    links = []
+    for host, port in peers:
+        link = BridgeLink(server, node_id, host, port)
+        link.start()
+        links.append(link)
+    return links
+
+def parse_peers(text: str):
+    """'host:port,host:port' 형식의 피어 목록 파싱"""
+    peers = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(':')
+        peers.append((host or '127.0.0.1', int(port)))
+    return peers
+
+def main():
+    """메인 함수"""
+    setup_logging()
+    print("브리지 모드 MQTT 서버를 시작합니다...")
+    node_id = input("노드 ID를 입력하세요 (기본값: 호스트 이름): ").strip() or socket.gethostname()
+    try:
+        port = int(input("포트를 입력하세요 (기본값: 1883): ").strip() or "1883")
+    except ValueError:
+        port = 1883
+    peers = parse_peers(input("피어 목록을 입력하세요 (예: 192.168.0.10:1883,192.168.0.11:1883): "))
+
+    server = MQTTServer(host='0.0.0.0', port=port)
+    links = start_bridges(server, node_id, peers)
+    print("종료하려면 Ctrl+C를 누르세요.")
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        print("\n서버를 종료합니다...")
+    finally:
+        for link in links:
+            link.stop()
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@ import paho.mqtt.client as mqtt
 import json
 import time
 import threading
-import socket
+
+from mqtt_batching import BATCH_TOPIC, batch_filter, decode_batch
 
 class RemoteMQTTClient:
     def __init__(self, client_id, broker_host='192.168.0.76', broker_port=1883):
@@ -16,8 +17,8 @@ class RemoteMQTTClient:
         self.connection_event = threading.Event()
         self.running = False
         
-        # 로컬 IP 주소 가져오기
-        self.local_ip = self.get_local_ip()
+        # 로컬 IP 주소 (연결 후 소켓에서 처음 사용할 때 확인)
+        self.cached_local_ip = None
         
         # 콜백 함수 설정
         self.client.on_connect = self.on_connect
@@ -26,23 +27,26 @@ class RemoteMQTTClient:
         self.client.on_subscribe = self.on_subscribe
         self.client.on_publish = self.on_publish
     
+    @property
+    def local_ip(self):
+        """브로커와 연결된 소켓의 로컬 IP 주소 (처음 사용할 때 확인)"""
+        if self.cached_local_ip is None:
+            local_ip = self.get_local_ip()
+            if local_ip == "unknown":
+                return local_ip
+            self.cached_local_ip = local_ip
+        return self.cached_local_ip
+    
     def get_local_ip(self):
-        """로컬 IP 주소 가져오기"""
+        """로컬 IP 주소 가져오기 (외부 네트워크에 연결하지 않음)"""
         try:
-            # 외부 연결을 통해 로컬 IP 확인
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip
+            # 브로커와 연결된 소켓의 로컬 주소 사용
+            sock = self.client.socket()
+            if sock is not None:
+                return sock.getsockname()[0]
         except Exception:
-            try:
-                # 대안 방법
-                hostname = socket.gethostname()
-                local_ip = socket.gethostbyname(hostname)
-                return local_ip
-            except Exception:
-                return "unknown"
+            pass
+        return "unknown"
         
     def on_connect(self, client, userdata, flags, rc):
         """연결 콜백"""
@@ -63,8 +67,17 @@ class RemoteMQTTClient:
     
     def on_message(self, client, userdata, msg):
         """메시지 수신 콜백"""
+        if msg.topic == BATCH_TOPIC:
+            self.on_batch(decode_batch(msg.payload))
+            return
         print(f"메시지 수신 - 토픽: {msg.topic}, 페이로드: {msg.payload.decode()}")
     
+    def on_batch(self, entries):
+        """배치 프레임 수신 (entries: [(토픽, 페이로드), ...])"""
+        print(f"배치 수신 - {len(entries)}개 메시지")
+        for topic, payload in entries:
+            print(f"  토픽: {topic}, 페이로드: {payload.decode()}")
+    
     def on_subscribe(self, client, userdata, mid, granted_qos):
         """구독 콜백"""
         print(f"구독 완료. QoS: {granted_qos}")
@@ -112,6 +125,10 @@ class RemoteMQTTClient:
             print("연결되지 않음")
             return None
     
+    def subscribe_batched(self, topic, interval_ms=100, max_count=500, codec='zlib', qos=0):
+        """배치 구독: 서버가 interval_ms마다 또는 max_count개마다 모아 압축해 전달"""
+        return self.subscribe(batch_filter(topic, interval_ms, max_count, codec), qos)
+    
     def unsubscribe(self, topic):
         """토픽 구독 해제"""
         if self.connected:
@@ -252,6 +269,36 @@ def remote_subscriber_test():
         print("원격 구독자 연결에 실패했습니다.")
         print("서버 IP 주소와 포트를 확인하세요.")
 
+def batch_subscriber_test():
+    """배치 구독자 테스트"""
+    # 서버 IP 주소를 입력받거나 기본값 사용
+    server_ip = input("서버 IP 주소를 입력하세요 (기본값: 192.168.0.76): ").strip()
+    if not server_ip:
+        server_ip = "192.168.0.76"
+    
+    # 배치 간격 입력
+    try:
+        interval_ms = int(input("배치 간격(ms)을 입력하세요 (기본값: 1000): ").strip() or "1000")
+    except ValueError:
+        interval_ms = 1000
+    
+    subscriber = RemoteMQTTClient("batch_subscriber", server_ip, 1883)
+    
+    print("배치 구독자 테스트 시작...")
+    
+    if subscriber.connect():
+        for topic in ["sensor/#", "device/#"]:
+            subscriber.subscribe_batched(topic, interval_ms=interval_ms)
+        
+        print("배치 구독 완료. 30초간 메시지 수신 대기 중...")
+        time.sleep(30)
+        
+        subscriber.disconnect()
+        print("배치 구독자 테스트 완료")
+    else:
+        print("배치 구독자 연결에 실패했습니다.")
+        print("서버 IP 주소와 포트를 확인하세요.")
+
 def remote_publisher_test():
     """원격 발행자 테스트"""
     # 서버 IP 주소를 입력받거나 기본값 사용
@@ -309,8 +356,9 @@ def main():
     print("2. 원격 발행자 테스트")
     print("3. 동시 테스트")
     print("4. 지속적인 PUB/SUB 테스트")
+    print("5. 배치 구독자 테스트")
     
-    choice = input("선택하세요 (1-4): ")
+    choice = input("선택하세요 (1-5): ")
     
     if choice == "1":
         remote_subscriber_test()
@@ -326,6 +374,8 @@ def main():
         remote_publisher_test()
     elif choice == "4":
         continuous_pubsub_test()
+    elif choice == "5":
+        batch_subscriber_test()
     else:
         print("잘못된 선택입니다.")
 
@@ -0,0 +1,314 @@
+import base64
+import hashlib
+import logging
+import socket
+import ssl
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# RFC 6455 핸드셰이크에 쓰는 고정 GUID
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# 웹소켓 opcode
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+def create_tls_context(certfile: str, keyfile: Optional[str] = None,
+                       session_tickets: bool = True, tickets_per_handshake: int = 1) -> ssl.SSLContext:
+    """서버용 TLS 컨텍스트 생성
+
+    세션 티켓을 켜면 재연결하는 클라이언트가 세션을 재개해
+    인증서 서명 등 전체 핸드셰이크 비용을 피할 수 있다.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    if session_tickets:
+        # TLS 1.3 세션 티켓 수 (TLS 1.2는 OpenSSL 기본 티켓/세션 캐시 사용)
+        context.num_tickets = tickets_per_handshake
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    return context
+
+class Listener:
+    """MQTT 리스너 (기본: 평문 TCP, ssl_context가 있으면 TLS)
+
+    리스닝 소켓은 논블로킹으로 열어 서버의 accept 루프에서 여러 리스너를
+    함께 감시한다. TLS/웹소켓 핸드셰이크는 클라이언트 스레드의 wrap()에서
+    수행하므로 느린 핸드셰이크가 다른 연결의 accept를 막지 않는다.
+    """
+
+    kind = 'tcp'
+    # False면 MQTT 대신 serve(client_socket, server)로 연결을 처리 (관리 리스너 등)
+    handles_mqtt = True
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 1883,
+                 ssl_context: Optional[ssl.SSLContext] = None,
+                 handshake_timeout: float = 10.0, backlog: int = 128):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.handshake_timeout = handshake_timeout
+        self.backlog = backlog
+        self.socket = None
+        # TLS 핸드셰이크 통계 (횟수, 재개된 세션 수, 서버 스레드 CPU 시간)
+        self.handshakes = 0
+        self.resumed_handshakes = 0
+        self.handshake_cpu_seconds = 0.0
+
+    @property
+    def name(self):
+        scheme = self.kind + ('+tls' if self.ssl_context else '')
+        return f"{scheme}://{self.host}:{self.port}"
+
+    def open(self) -> socket.socket:
+        """논블로킹 리스닝 소켓 열기"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.socket.setblocking(False)
+        # 포트 0으로 열었으면 실제 포트 기록
+        self.port = self.socket.getsockname()[1]
+        return self.socket
+
+    def accept(self):
+        """대기 중인 연결 하나 수락 (없으면 None)"""
+        try:
+            client_socket, address = self.socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return None
+        client_socket.setblocking(True)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client_socket, address
+
+    def wrap(self, client_socket: socket.socket, server=None):
+        """TLS/프로토콜 핸드셰이크 후 MQTT 패킷을 읽고 쓸 스트림 반환"""
+        client_socket.settimeout(self.handshake_timeout)
+        if self.ssl_context is not None:
+            started = time.thread_time()
+            client_socket = self.ssl_context.wrap_socket(client_socket, server_side=True)
+            self.handshake_cpu_seconds += time.thread_time() - started
+            self.handshakes += 1
+            if client_socket.session_reused:
+                self.resumed_handshakes += 1
+        stream = self.upgrade(client_socket, server)
+        client_socket.settimeout(None)
+        return stream
+
+    def upgrade(self, client_socket, server=None):
+        """TLS 이후 추가 핸드셰이크 (평문 MQTT는 없음)"""
+        return client_socket
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+class TLSListener(Listener):
+    """MQTT over TLS 리스너 (기본 포트 8883)"""
+
+    def __init__(self, certfile: str, keyfile: Optional[str] = None, host: str = '0.0.0.0',
+                 port: int = 8883, session_tickets: bool = True, **kwargs):
+        super().__init__(host, port, create_tls_context(certfile, keyfile, session_tickets), **kwargs)
+
+class WebSocketListener(Listener):
+    """MQTT over WebSocket 리스너 (ssl_context가 있으면 wss)
+
+    max_frame_size를 지정하지 않으면 서버의 최대 패킷 크기를 프레임 한도로 쓴다.
+    """
+
+    kind = 'ws'
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080, path: str = '/mqtt',
+                 max_frame_size: Optional[int] = None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.path = path
+        self.max_frame_size = max_frame_size
+
+    def upgrade(self, client_socket, server=None):
+        """HTTP Upgrade 요청을 처리하고 웹소켓 스트림 반환"""
+        request = bytearray()
+        while b'\r\n\r\n' not in request:
+            chunk = client_socket.recv(4096)
+            if not chunk:
+                raise ConnectionError("웹소켓 핸드셰이크 중 연결이 끊어졌습니다")
+            request.extend(chunk)
+            if len(request) > 16384:
+                raise ValueError("웹소켓 핸드셰이크 요청이 너무 큽니다")
+        head, _, rest = bytes(request).partition(b'\r\n\r\n')
+
+        lines = head.decode('latin-1').split('\r\n')
+        method, path, _ = (lines[0].split(' ') + ['', '', ''])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if (method != 'GET' or path.split('?')[0] != self.path or key is None
+                or 'websocket' not in headers.get('upgrade', '').lower()):
+            client_socket.sendall(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            raise ValueError(f"잘못된 웹소켓 요청: {lines[0]}")
+
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WEBSOCKET_GUID).digest())
+        response = [
+            b'HTTP/1.1 101 Switching Protocols',
+            b'Upgrade: websocket',
+            b'Connection: Upgrade',
+            b'Sec-WebSocket-Accept: ' + accept,
+        ]
+        protocols = [item.strip() for item in headers.get('sec-websocket-protocol', '').split(',')]
+        for protocol in ('mqtt', 'mqttv3.1'):
+            if protocol in protocols:
+                response.append(b'Sec-WebSocket-Protocol: ' + protocol.encode('ascii'))
+                break
+        client_socket.sendall(b'\r\n'.join(response) + b'\r\n\r\n')
+
+        max_frame_size = self.max_frame_size
+        if max_frame_size is None and server is not None:
+            max_frame_size = server.maximum_packet_size
+        return WebSocketStream(client_socket, rest, max_frame_size)
+
+class WebSocketStream:
+    """웹소켓 바이너리 프레임 위의 바이트 스트림 (MQTTClient가 쓰는 소켓 메서드 제공)
+
+    프레임 길이는 클라이언트가 정하므로, max_frame_size를 넘는 프레임은
+    버퍼에 모으기 전에 거부하고 연결을 닫는다 (None = 제한 없음).
+    """
+
+    def __init__(self, sock, initial: bytes = b'', max_frame_size: Optional[int] = None):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        # 아직 프레임으로 해석하지 않은 원시 바이트와 해석된 MQTT 데이터
+        self.raw = bytearray(initial)
+        self.data = bytearray()
+        self.write_lock = threading.Lock()
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size: int) -> bytes:
+        if not self.data and not self.fill():
+            return b''
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+    def recv_into(self, view, size: int = 0) -> int:
+        if not self.data and not self.fill():
+            return 0
+        count = min(size or len(view), len(view), len(self.data))
+        view[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+    def sendall(self, data):
+        self.send_frame(OPCODE_BINARY, data)
+
+    def send(self, data) -> int:
+        self.send_frame(OPCODE_BINARY, data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send_frame(OPCODE_CLOSE, b'')
+            except OSError:
+                pass
+        self.sock.close()
+
+    def send_frame(self, opcode: int, data):
+        """서버 -> 클라이언트 프레임 전송 (마스킹 없음)"""
+        length = len(data)
+        if length < 126:
+            header = bytes((0x80 | opcode, length))
+        elif length < 65536:
+            header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+        else:
+            header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+        with self.write_lock:
+            self.sock.sendall(header + bytes(data))
+
+    def read_raw(self, size: int) -> bool:
+        """원시 버퍼에 size 바이트 이상 모으기 (연결이 끊기면 False)"""
+        while len(self.raw) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return False
+            self.raw.extend(chunk)
+        return True
+
+    def fill(self) -> bool:
+        """데이터 프레임이 올 때까지 프레임 읽기 (연결 종료 시 False)"""
+        while not self.data:
+            if not self.read_raw(2):
+                return False
+            first, second = self.raw[0], self.raw[1]
+            opcode = first & 0x0F
+            masked = second & 0x80
+            length = second & 0x7F
+            offset = 2
+            if length == 126:
+                if not self.read_raw(4):
+                    return False
+                length = int.from_bytes(self.raw[2:4], 'big')
+                offset = 4
+            elif length == 127:
+                if not self.read_raw(10):
+                    return False
+                length = int.from_bytes(self.raw[2:10], 'big')
+                offset = 10
+            # RFC 6455: 클라이언트 프레임은 반드시 마스킹되어야 함
+            if not masked:
+                logger.error("마스킹되지 않은 웹소켓 클라이언트 프레임")
+                return self.fail(1002)
+            if self.max_frame_size is not None and length > self.max_frame_size:
+                logger.error(f"웹소켓 프레임 크기 초과: {length} bytes")
+                return self.fail(1009)
+            if not self.read_raw(offset + 4):
+                return False
+            mask = bytes(self.raw[offset:offset + 4])
+            offset += 4
+            if not self.read_raw(offset + length):
+                return False
+            payload = bytes(self.raw[offset:offset + length])
+            del self.raw[:offset + length]
+            if payload:
+                # 마스크를 정수 XOR로 한 번에 해제
+                repeated = (mask * (length // 4 + 1))[:length]
+                payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+            if opcode in (OPCODE_BINARY, OPCODE_CONTINUATION, OPCODE_TEXT):
+                self.data.extend(payload)
+            elif opcode == OPCODE_PING:
+                self.send_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                if not self.closed:
+                    self.closed = True
+                    self.send_frame(OPCODE_CLOSE, payload[:2])
+                return False
+        return True
+
+    def fail(self, status: int) -> bool:
+        """상태 코드(1002 = 프로토콜 오류, 1009 = 메시지가 너무 큼)로 닫기 프레임을 보내고 False 반환"""
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send_frame(OPCODE_CLOSE, status.to_bytes(2, 'big'))
+            except OSError:
+                pass
+        return False
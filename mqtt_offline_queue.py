@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 메시지 한 개당 객체 오버헤드 추정치 (메모리 한도 계산용)
+MESSAGE_OVERHEAD = 64
+
+class OfflineQueue:
+    """연결이 끊긴 영속 세션 하나의 오프라인 메시지 큐
+
+    메모리 한도까지는 메시지 객체를 그대로 보관하고,
+    한도를 넘으면 디스크 세그먼트 파일에 이어 쓴다.
+    메모리의 메시지는 항상 디스크의 메시지보다 오래된 것이다.
+    """
+
+    __slots__ = ('client_id', 'subscriptions', 'expires_at', 'messages',
+                 'memory_bytes', 'segments', 'segment_bytes', 'segment_sequence',
+                 'file_prefix', 'dropped')
+
+    def __init__(self, client_id: str, subscriptions: tuple, expires_at: Optional[float]):
+        self.client_id = client_id
+        self.subscriptions = subscriptions
+        self.expires_at = expires_at
+        self.messages = deque()
+        self.memory_bytes = 0
+        # 디스크 세그먼트 경로 (오래된 순서)
+        self.segments = []
+        self.segment_bytes = 0
+        self.segment_sequence = 0
+        # 세그먼트 파일 이름 접두사 (디스크에 처음 쓸 때 계산)
+        self.file_prefix = None
+        self.dropped = 0
+
+    def expired(self, now: float) -> bool:
+        """세션 만료 여부"""
+        return self.expires_at is not None and self.expires_at <= now
+
+class OfflineStore:
+    """모든 오프라인 큐 관리 (세션별/전체 메모리 한도 적용)"""
+
+    def __init__(self, decode_record: Callable[[bytes], object],
+                 session_memory_limit: int = 1024 * 1024,
+                 global_memory_limit: int = 256 * 1024 * 1024,
+                 segment_size: int = 4 * 1024 * 1024,
+                 spool_dir: Optional[str] = None,
+                 on_expire: Optional[Callable[[OfflineQueue], None]] = None):
+        self.decode_record = decode_record
+        self.session_memory_limit = session_memory_limit
+        self.global_memory_limit = global_memory_limit
+        self.segment_size = segment_size
+        self.spool_dir = spool_dir
+        self.owns_spool_dir = spool_dir is None
+        self.on_expire = on_expire
+        self.queues: Dict[str, OfflineQueue] = {}
+        self.memory_bytes = 0
+        # 서버가 클라이언트 목록 변경과 큐 생성/제거를 한 잠금으로 묶을 수 있도록 재진입 가능
+        self.lock = threading.RLock()
+
+    def open(self, client_id: str, subscriptions: tuple, expires_at: Optional[float]):
+        """영속 세션이 오프라인이 될 때 큐 생성"""
+        with self.lock:
+            queue = self.queues.get(client_id)
+            if queue is None:
+                queue = self.queues[client_id] = OfflineQueue(client_id, subscriptions, expires_at)
+            else:
+                queue.subscriptions = subscriptions
+                queue.expires_at = expires_at
+        logger.info(f"오프라인 큐 생성: {client_id}")
+        return queue
+
+    def restore(self, sessions) -> int:
+        """(클라이언트 ID, 구독, 만료 시각) 목록으로 큐 일괄 생성 (스냅샷 복원용, 항목별 로그 없음)"""
+        count = 0
+        with self.lock:
+            for client_id, subscriptions, expires_at in sessions:
+                if client_id not in self.queues:
+                    self.queues[client_id] = OfflineQueue(client_id, subscriptions, expires_at)
+                    count += 1
+        logger.info(f"오프라인 세션 일괄 복원: {count}개")
+        return count
+
+    def get(self, client_id: str) -> Optional[OfflineQueue]:
+        """세션의 오프라인 큐 조회 (만료된 세션은 제거)"""
+        with self.lock:
+            queue = self.queues.get(client_id)
+            if queue is not None and queue.expired(time.monotonic()):
+                self._remove(queue)
+                expired = queue
+                queue = None
+            else:
+                expired = None
+        if expired is not None:
+            self._expire(expired)
+        return queue
+
+    def append(self, client_id: str, message) -> bool:
+        """오프라인 세션에 메시지 추가 (세션이 없으면 False)"""
+        expired = None
+        with self.lock:
+            queue = self.queues.get(client_id)
+            if queue is None:
+                return False
+            if queue.expired(time.monotonic()):
+                self._remove(queue)
+                expired = queue
+            else:
+                size = len(message.payload) + len(message.topic.name) + MESSAGE_OVERHEAD
+                # 이미 디스크로 넘긴 메시지가 있으면 순서를 지키기 위해 계속 디스크에 기록
+                if (queue.segments
+                        or queue.memory_bytes + size > self.session_memory_limit
+                        or self.memory_bytes + size > self.global_memory_limit):
+                    self._spill(queue, message)
+                else:
+                    queue.messages.append((message, size))
+                    queue.memory_bytes += size
+                    self.memory_bytes += size
+        if expired is not None:
+            self._expire(expired)
+            return False
+        return True
+
+    def expire_sessions(self) -> int:
+        """만료된 세션 큐를 모두 제거하고 만료 알림 (메시지를 받지 않는 세션도 정리하도록 주기적으로 호출)"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [queue for queue in self.queues.values()
+                       if queue.expires_at is not None and queue.expires_at <= now]
+            for queue in expired:
+                self._remove(queue)
+        for queue in expired:
+            self._expire(queue)
+        return len(expired)
+
+    def drain(self, client_id: str, deliver_batch: Callable[[list], None],
+              on_empty: Callable[[], None], batch_size: int = 256) -> int:
+        """오프라인 큐를 배치 단위로 전달하고, 비면 on_empty 호출 후 큐 제거
+
+        on_empty는 잠금 안에서 호출되므로, 그 사이에 발행된 메시지는
+        큐에 들어가거나 온라인 클라이언트로 바로 전달되고 유실되지 않는다.
+        """
+        delivered = 0
+        while True:
+            with self.lock:
+                queue = self.queues.get(client_id)
+                batch = self._pop_batch(queue, batch_size) if queue is not None else []
+                if not batch:
+                    on_empty()
+                    if queue is not None:
+                        self._remove(queue)
+                    break
+            deliver_batch(batch)
+            delivered += len(batch)
+        if delivered:
+            logger.info(f"오프라인 큐 전달 완료: {client_id} ({delivered}개)")
+        return delivered
+
+    def close(self, client_id: str) -> Optional[OfflineQueue]:
+        """세션을 버리고 큐 제거 (Clean Session 재연결 시)"""
+        with self.lock:
+            queue = self.queues.get(client_id)
+            if queue is not None:
+                self._remove(queue)
+        return queue
+
+    def shutdown(self):
+        """모든 큐 제거 및 스풀 디렉터리 정리"""
+        with self.lock:
+            for queue in list(self.queues.values()):
+                self._remove(queue)
+            if self.owns_spool_dir and self.spool_dir:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+                self.spool_dir = None
+
+    def _remove(self, queue: OfflineQueue):
+        """큐 제거 (잠금 안에서 호출)"""
+        self.queues.pop(queue.client_id, None)
+        self.memory_bytes -= queue.memory_bytes
+        queue.memory_bytes = 0
+        queue.messages.clear()
+        for path in queue.segments:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"오프라인 세그먼트 삭제 오류: {e}")
+        queue.segments = []
+
+    def _expire(self, queue: OfflineQueue):
+        """만료된 세션 알림"""
+        logger.info(f"세션 만료: {queue.client_id}")
+        if self.on_expire is not None:
+            self.on_expire(queue)
+
+    def _spill(self, queue: OfflineQueue, message):
+        """메시지를 디스크 세그먼트에 기록 (잠금 안에서 호출)"""
+        try:
+            if self.spool_dir is None:
+                self.spool_dir = tempfile.mkdtemp(prefix='mqtt-spool-')
+            elif not queue.segments:
+                os.makedirs(self.spool_dir, exist_ok=True)
+            if queue.file_prefix is None:
+                queue.file_prefix = hashlib.sha1(queue.client_id.encode('utf-8')).hexdigest()
+            record = message.to_record()
+            if not queue.segments or queue.segment_bytes + len(record) + 4 > self.segment_size:
+                queue.segment_sequence += 1
+                queue.segments.append(os.path.join(
+                    self.spool_dir, f"{queue.file_prefix}-{queue.segment_sequence:08d}.seg"))
+                queue.segment_bytes = 0
+            with open(queue.segments[-1], 'ab') as segment:
+                segment.write(len(record).to_bytes(4, 'big'))
+                segment.write(record)
+            queue.segment_bytes += len(record) + 4
+        except OSError as e:
+            queue.dropped += 1
+            logger.error(f"오프라인 메시지 디스크 기록 오류 ({queue.client_id}): {e}")
+
+    def _load_segment(self, queue: OfflineQueue):
+        """가장 오래된 세그먼트를 메모리로 읽어들임 (잠금 안에서 호출)"""
+        path = queue.segments.pop(0)
+        try:
+            with open(path, 'rb') as segment:
+                data = segment.read()
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"오프라인 세그먼트 읽기 오류: {e}")
+            return
+        offset = 0
+        view = memoryview(data)
+        while offset + 4 <= len(data):
+            length = int.from_bytes(view[offset:offset + 4], 'big')
+            offset += 4
+            message = self.decode_record(view[offset:offset + length])
+            offset += length
+            size = len(message.payload) + len(message.topic.name) + MESSAGE_OVERHEAD
+            queue.messages.append((message, size))
+            queue.memory_bytes += size
+            self.memory_bytes += size
+
+    def _pop_batch(self, queue: OfflineQueue, batch_size: int) -> list:
+        """큐 앞쪽에서 최대 batch_size개 꺼내기 (잠금 안에서 호출)"""
+        if not queue.messages and queue.segments:
+            self._load_segment(queue)
+        batch = []
+        messages = queue.messages
+        while messages and len(batch) < batch_size:
+            message, size = messages.popleft()
+            queue.memory_bytes -= size
+            self.memory_bytes -= size
+            batch.append(message)
+        return batch
@@ -1,56 +1,492 @@
 import asyncio
 import logging
 import json
+import os
+import selectors
 from datetime import datetime
 from typing import Dict, Set, Optional
 import socket
+import struct
+import sys
 import threading
 import time
+import uuid
+
+from mqtt_admin import AdminListener
+from mqtt_batching import BATCH_PREFIX, BATCH_TOPIC, Batcher, BatchSpec, parse_batch_filter
+from mqtt_listeners import Listener
+from mqtt_offline_queue import OfflineStore
+from mqtt_snapshot import NEVER_EXPIRES, read_snapshot, write_snapshot
+from mqtt_trace import SamplingProfiler, Tracer
 
-# 로깅 설정
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('mqtt_server_network.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging(log_file: Optional[str] = 'mqtt_server_network.log', level: int = logging.INFO):
+    """로깅 설정 (import 시점이 아닌 main()에서 호출, 이미 설정되어 있으면 유지)"""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+# 오프라인 큐 전달 등 일괄 전송에 쓰는 버퍼 크기
+BATCH_BUFFER_SIZE = 65536
+
+# MQTT 5 세션 만료 간격 최대값 (만료되지 않음)
+SESSION_NEVER_EXPIRES = NEVER_EXPIRES
+
+# 브리지 링크가 피어 서버에 접속할 때 쓰는 클라이언트 ID 접두사
+BRIDGE_CLIENT_PREFIX = '$bridge/'
+
+# 서버가 지원하는 최대 QoS (QoS 2 흐름은 구현하지 않음)
+MAXIMUM_QOS = 1
+
+# 구독이 이보다 많은 클라이언트(주로 브리지)는 튜플 대신 집합으로 구독을 보관
+SUBSCRIPTION_SET_THRESHOLD = 32
+
+# 자주 쓰이는 고정 응답 패킷
+CONNACK_ACCEPTED = b'\x20\x02\x00\x00'
+CONNACK_SESSION_PRESENT = b'\x20\x02\x01\x00'
+PINGRESP = b'\xd0\x00'
+# MQTT 5 DISCONNECT (이유 코드 0x95 = 패킷이 너무 큼)
+DISCONNECT_PACKET_TOO_LARGE = b'\xe0\x01\x95'
+
+def read_utf8_string(data, offset: int):
+    """길이 접두(2바이트) UTF-8 문자열 읽기 -> (문자열, 다음 오프셋)"""
+    if len(data) < offset + 2:
+        raise ValueError("문자열 길이를 읽을 수 없습니다")
+    length = (data[offset] << 8) | data[offset + 1]
+    end = offset + 2 + length
+    if len(data) < end:
+        raise ValueError("문자열을 읽을 수 없습니다")
+    return str(data[offset + 2:end], 'utf-8'), end
+
+def write_remaining_length(buffer: bytearray, offset: int, length: int) -> int:
+    """버퍼의 offset 위치에 나머지 길이를 인코딩하고 다음 오프셋 반환"""
+    while True:
+        byte = length % 128
+        length = length // 128
+        if length > 0:
+            byte |= 0x80
+        buffer[offset] = byte
+        offset += 1
+        if length == 0:
+            return offset
+
+def packet_size(remaining_length: int) -> int:
+    """고정 헤더(패킷 타입 1바이트 + 나머지 길이)를 포함한 전체 패킷 크기"""
+    size = remaining_length + 2
+    while remaining_length >= 128:
+        remaining_length //= 128
+        size += 1
+    return size
+
+class BufferPool:
+    """연결 간에 공유하는 읽기/쓰기 버퍼 풀
+
+    버퍼는 패킷을 처리하는 동안에만 빌려 쓰고 즉시 반납하므로,
+    유휴 연결은 버퍼를 하나도 점유하지 않는다.
+    """
+
+    def __init__(self, size_classes=(256, 4096, 65536), max_free: int = 64):
+        self.size_classes = size_classes
+        self.max_free = max_free
+        self.free: Dict[int, list] = {size: [] for size in size_classes}
+
+    def acquire(self, size: int) -> bytearray:
+        """size 이상의 버퍼 빌리기"""
+        for size_class in self.size_classes:
+            if size <= size_class:
+                try:
+                    return self.free[size_class].pop()
+                except IndexError:
+                    return bytearray(size_class)
+        # 가장 큰 크기보다 큰 패킷은 풀링하지 않는다
+        return bytearray(size)
+
+    def release(self, buffer: bytearray):
+        """버퍼 반납"""
+        free = self.free.get(len(buffer))
+        if free is not None and len(free) < self.max_free:
+            free.append(buffer)
+
+def read_variable_int(data, offset: int):
+    """가변 길이 정수 읽기 -> (값, 다음 오프셋)"""
+    multiplier = 1
+    value = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("가변 길이 정수를 읽을 수 없습니다")
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        if (byte & 0x80) == 0:
+            return value, offset
+        multiplier *= 128
+        if multiplier > 128 * 128 * 128:
+            raise ValueError("가변 길이 정수가 너무 큽니다")
+
+# MQTT 5 속성 식별자
+PROPERTY_MESSAGE_EXPIRY_INTERVAL = 0x02
+PROPERTY_SUBSCRIPTION_IDENTIFIER = 0x0B
+PROPERTY_SESSION_EXPIRY_INTERVAL = 0x11
+PROPERTY_ASSIGNED_CLIENT_IDENTIFIER = 0x12
+PROPERTY_RECEIVE_MAXIMUM = 0x21
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_MAXIMUM_QOS = 0x24
+PROPERTY_RETAIN_AVAILABLE = 0x25
+PROPERTY_USER_PROPERTY = 0x26
+PROPERTY_MAXIMUM_PACKET_SIZE = 0x27
+PROPERTY_SHARED_SUBSCRIPTION_AVAILABLE = 0x2A
+
+# MQTT 5 속성 값 형식: 1/2/4 = 고정 크기 정수, 'v' = 가변 길이 정수,
+# 's' = UTF-8 문자열/바이너리, 'p' = 문자열 쌍
+PROPERTY_TYPES = {
+    0x01: 1, 0x02: 4, 0x03: 's', 0x08: 's', 0x09: 's', 0x0B: 'v',
+    0x11: 4, 0x12: 's', 0x13: 2, 0x15: 's', 0x16: 's', 0x17: 1,
+    0x18: 4, 0x19: 1, 0x1A: 's', 0x1C: 's', 0x1F: 's', 0x21: 2,
+    0x22: 2, 0x23: 2, 0x24: 1, 0x25: 1, 0x26: 'p', 0x27: 4,
+    0x28: 1, 0x29: 1, 0x2A: 1,
+}
+
+# 서버가 다시 계산하므로 구독자에게 그대로 전달하지 않는 PUBLISH 속성
+NON_FORWARDED_PROPERTIES = (
+    PROPERTY_MESSAGE_EXPIRY_INTERVAL,
+    PROPERTY_SUBSCRIPTION_IDENTIFIER,
+    PROPERTY_TOPIC_ALIAS,
+)
+
+def skip_properties(data, offset: int) -> int:
+    """속성 블록을 건너뛰고 다음 오프셋 반환"""
+    length, offset = read_variable_int(data, offset)
+    return offset + length
+
+def encode_property(identifier: int, value) -> bytes:
+    """속성 하나 인코딩"""
+    kind = PROPERTY_TYPES[identifier]
+    if kind == 'v':
+        encoded = bytearray(4)
+        return bytes([identifier]) + encoded[:write_remaining_length(encoded, 0, value)]
+    if kind == 's':
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        return bytes([identifier]) + len(value).to_bytes(2, 'big') + value
+    if kind == 'p':
+        name, text = (part.encode('utf-8') for part in value)
+        return (bytes([identifier]) + len(name).to_bytes(2, 'big') + name
+                + len(text).to_bytes(2, 'big') + text)
+    return bytes([identifier]) + value.to_bytes(kind, 'big')
+
+def encode_properties(data: bytes) -> bytes:
+    """인코딩된 속성들 앞에 속성 길이 붙이기"""
+    encoded = bytearray(4)
+    return bytes(encoded[:write_remaining_length(encoded, 0, len(data))]) + data
+
+class Properties:
+    """MQTT 5 속성 블록
+
+    원본 바이트만 보관하고 값은 처음 접근할 때 디코딩한다.
+    속성을 쓰지 않는 프레임은 디코딩 비용을 전혀 치르지 않는다.
+    """
+
+    __slots__ = ('data', 'values', 'forwarded')
+
+    def __init__(self, data: bytes = b''):
+        self.data = data
+        self.values: Optional[Dict[int, object]] = None
+        self.forwarded: Optional[bytes] = None
+
+    def __bool__(self):
+        return len(self.data) > 0
+
+    def scan(self):
+        """(식별자, 값, 시작 오프셋, 끝 오프셋) 순회"""
+        data = self.data
+        offset = 0
+        while offset < len(data):
+            start = offset
+            identifier = data[offset]
+            offset += 1
+            kind = PROPERTY_TYPES.get(identifier)
+            if kind is None:
+                raise ValueError(f"알 수 없는 속성: {identifier:#x}")
+            if kind == 'v':
+                value, offset = read_variable_int(data, offset)
+            elif kind == 's':
+                length = (data[offset] << 8) | data[offset + 1]
+                value = data[offset + 2:offset + 2 + length]
+                offset += 2 + length
+            elif kind == 'p':
+                name, offset = read_utf8_string(data, offset)
+                text, offset = read_utf8_string(data, offset)
+                value = (name, text)
+            else:
+                value = int.from_bytes(data[offset:offset + kind], 'big')
+                offset += kind
+            if offset > len(data):
+                raise ValueError("속성 길이가 올바르지 않습니다")
+            yield identifier, value, start, offset
+
+    def get(self, identifier: int, default=None):
+        """속성 값 조회 (사용자 속성은 (이름, 값) 목록)"""
+        if not self.data:
+            return default
+        if self.values is None:
+            values = {}
+            for found, value, _, _ in self.scan():
+                if found == PROPERTY_USER_PROPERTY:
+                    values.setdefault(found, []).append(value)
+                else:
+                    values[found] = value
+            self.values = values
+        return self.values.get(identifier, default)
+
+    def forwardable(self) -> bytes:
+        """구독자에게 그대로 전달할 속성 바이트 (별칭/만료 등 제외)"""
+        if not self.data:
+            return b''
+        if self.forwarded is None:
+            self.forwarded = b''.join(
+                self.data[start:end] for identifier, _, start, end in self.scan()
+                if identifier not in NON_FORWARDED_PROPERTIES
+            )
+        return self.forwarded
+
+EMPTY_PROPERTIES = Properties()
+
+def read_properties(data, offset: int):
+    """속성 블록 읽기 -> (Properties, 다음 오프셋)"""
+    length, offset = read_variable_int(data, offset)
+    end = offset + length
+    if len(data) < end:
+        raise ValueError("속성 블록을 읽을 수 없습니다")
+    if length == 0:
+        return EMPTY_PROPERTIES, end
+    return Properties(bytes(data[offset:end])), end
+
+# 메시지 레코드 헤더: 만료 시각(monotonic, 없으면 -1), QoS, 토픽/속성/페이로드 길이
+MESSAGE_RECORD_HEADER = struct.Struct('>dBHII')
+
+class Message:
+    """라우팅 중인 메시지 (만료 시각은 monotonic 기준)"""
+
+    __slots__ = ('topic', 'payload', 'qos', 'properties', 'expires_at', 'trace', 'retain')
+
+    def __init__(self, topic: 'Topic', payload: bytes, qos: int = 0,
+                 properties: Properties = EMPTY_PROPERTIES, retain: int = 0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.properties = properties
+        # 보관 메시지를 구독 시점에 보낼 때만 1 (라우팅되는 메시지는 0)
+        self.retain = retain
+        expiry_interval = properties.get(PROPERTY_MESSAGE_EXPIRY_INTERVAL)
+        self.expires_at = None if expiry_interval is None else time.monotonic() + expiry_interval
+        # 샘플링된 메시지의 단계별 타임스탬프 (대부분 None)
+        self.trace = None
+
+    def expired(self, now: float) -> bool:
+        """만료 여부"""
+        return self.expires_at is not None and self.expires_at <= now
+
+    def to_record(self) -> bytes:
+        """디스크 기록용 직렬화"""
+        topic = self.topic.encoded[2:]
+        header = MESSAGE_RECORD_HEADER.pack(
+            -1.0 if self.expires_at is None else self.expires_at,
+            self.qos, len(topic), len(self.properties.data), len(self.payload))
+        return b''.join((header, topic, self.properties.data, self.payload))
+
+    @classmethod
+    def from_record(cls, data, topics: 'TopicTable') -> 'Message':
+        """to_record로 직렬화한 메시지 복원"""
+        expires_at, qos, topic_length, properties_length, payload_length = \
+            MESSAGE_RECORD_HEADER.unpack_from(data, 0)
+        offset = MESSAGE_RECORD_HEADER.size
+        topic = topics.lookup(data[offset:offset + topic_length])
+        offset += topic_length
+        properties = Properties(bytes(data[offset:offset + properties_length])) \
+            if properties_length else EMPTY_PROPERTIES
+        offset += properties_length
+        message = cls(topic, bytes(data[offset:offset + payload_length]), qos, properties)
+        message.expires_at = None if expires_at < 0 else expires_at
+        return message
+
+    def v5_properties(self, now: float) -> bytes:
+        """MQTT 5 구독자에게 보낼 속성 (남은 만료 시간 포함, 별칭 제외)"""
+        data = self.properties.forwardable()
+        if self.expires_at is not None:
+            remaining = max(0, int(self.expires_at - now + 0.999))
+            data += encode_property(PROPERTY_MESSAGE_EXPIRY_INTERVAL, remaining)
+        return data
+
+class Topic:
+    """intern 된 토픽: 이름, 미리 나눈 레벨, 미리 인코딩한 형태를 함께 보관"""
+
+    __slots__ = ('name', 'levels', 'encoded', 'match_generation', 'matched_filters')
+
+    def __init__(self, name: str, encoded: bytes):
+        self.name = sys.intern(name)
+        self.levels = tuple(sys.intern(level) for level in name.split('/'))
+        # 길이 접두(2바이트)를 포함한 인코딩 형태
+        self.encoded = len(encoded).to_bytes(2, 'big') + encoded
+        # 구독 매칭 결과 캐시 (구독이 바뀌면 세대 번호로 무효화)
+        self.match_generation = -1
+        self.matched_filters = ()
+
+    def __repr__(self):
+        return f"Topic({self.name!r})"
+
+class TopicTable:
+    """토픽 바이트 -> 정규 Topic 객체 intern 테이블"""
+
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self.topics: Dict[bytes, Topic] = {}
+
+    def lookup(self, data) -> Topic:
+        """수신한 토픽 바이트로 Topic 찾기 (없으면 생성)"""
+        key = bytes(data)
+        topic = self.topics.get(key)
+        if topic is None:
+            topic = Topic(key.decode('utf-8'), key)
+            # 테이블이 가득 차면 캐시하지 않고 일회성 Topic 사용
+            if len(self.topics) < self.max_size:
+                topic = self.topics.setdefault(key, topic)
+        return topic
+
+    def get(self, name: str) -> Topic:
+        """토픽 이름으로 Topic 찾기"""
+        return self.lookup(name.encode('utf-8'))
+
+def is_bridge_client(client_id: str) -> bool:
+    """다른 서버 노드의 브리지 링크 연결인지 확인"""
+    return client_id.startswith(BRIDGE_CLIENT_PREFIX)
+
+def topic_matches(filter_levels, topic_levels) -> bool:
+    """토픽 필터 레벨이 토픽 레벨과 일치하는지 확인 (+, # 와일드카드 지원)"""
+    # '$'로 시작하는 토픽은 첫 레벨 와일드카드와 매칭되지 않는다
+    if topic_levels[0].startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
 class MQTTServer:
-    def __init__(self, host='0.0.0.0', port=1883):
+    def __init__(self, host='0.0.0.0', port=1883, spool_dir: Optional[str] = None,
+                 session_memory_limit: int = 1024 * 1024,
+                 global_memory_limit: int = 256 * 1024 * 1024, listeners=None,
+                 snapshot_path: Optional[str] = None, maximum_packet_size: int = 1024 * 1024):
         self.host = host
         self.port = port
+        # 시작할 때 복원하고 종료할 때 저장하는 스냅샷 (영속 세션 구독, 보관 메시지)
+        self.snapshot_path = snapshot_path
         self.clients: Dict[str, 'MQTTClient'] = {}
         self.subscriptions: Dict[str, Set[str]] = {}
         self.server_socket = None
+        self.listeners = list(listeners or [])
+        self.selector = None
         self.running = False
+        self.buffer_pool = BufferPool()
+        self.topics = TopicTable()
+        self.wildcard_filters: Dict[str, tuple] = {}
+        self.subscription_generation = 0
+        self.subscription_lock = threading.Lock()
+        # 로컬(브리지가 아닌) 구독자가 있는 필터별 구독자 수와 연결된 브리지 링크
+        self.local_filters: Dict[str, int] = {}
+        self.bridges = []
+        # 배치 구독 ($batch/<간격ms>/<최대 개수>/<코덱>/<필터>) 설정과 배치 모음
+        self.batch_filters: Dict[str, BatchSpec] = {}
+        self.batcher = Batcher(self.deliver_batch_frame)
+        # MQTT 5 클라이언트에게 허용하는 수신 토픽 별칭 최대값과 수신 최대값
+        self.topic_alias_maximum = 1024
+        self.receive_maximum = 65535
+        # 클라이언트에게서 받는 최대 패킷 크기 (넘으면 버퍼를 할당하기 전에 연결 종료)
+        self.maximum_packet_size = maximum_packet_size
+        # 토픽별 보관(retained) 메시지
+        self.retained: Dict[str, Message] = {}
+        # 연결이 끊긴 영속 세션의 오프라인 메시지 큐 (한도를 넘으면 디스크로)
+        self.offline_store = OfflineStore(
+            lambda data: Message.from_record(data, self.topics),
+            session_memory_limit=session_memory_limit,
+            global_memory_limit=global_memory_limit,
+            spool_dir=spool_dir,
+            on_expire=self.end_session,
+        )
+        # 만료된 오프라인 세션을 정리하는 주기 (초)
+        self.session_sweep_interval = 1.0
+        self.sweep_stopped = threading.Event()
+        # 1/N 메시지 단계별 지연 추적과 스레드 샘플링 프로파일러 (관리 명령으로 켜고 끔)
+        self.tracer = Tracer()
+        self.profiler = SamplingProfiler(ignore_codes=(
+            MQTTClient.read_packet_header.__code__,
+            selectors.DefaultSelector.select.__code__,
+            threading.Condition.wait.__code__,
+            AdminListener.serve.__code__,
+        ))
         
+    def add_listener(self, listener: Listener):
+        """추가 리스너 등록 (TLS, 웹소켓 등). start() 전에 호출"""
+        self.listeners.append(listener)
+    
     def start(self):
         """MQTT 서버 시작"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            # 리스너를 열기 전에 스냅샷을 복원해 재접속하는 클라이언트가 바로 세션을 이어받도록 함
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                self.load_snapshot()
+
+            # 기본 평문 TCP 리스너와 추가 리스너를 논블로킹으로 열어 함께 감시
+            default_listener = Listener(self.host, self.port)
+            self.server_socket = default_listener.open()
+            self.port = default_listener.port
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ, default_listener)
+            for listener in self.listeners:
+                self.selector.register(listener.open(), selectors.EVENT_READ, listener)
+            self.listeners.insert(0, default_listener)
             self.running = True
             
+            # 메시지를 받지 않는 만료 세션도 구독과 큐를 정리하도록 주기적으로 검사
+            self.sweep_stopped.clear()
+            sweeper = threading.Thread(target=self.sweep_sessions, name='session-sweeper')
+            sweeper.daemon = True
+            sweeper.start()
+            
             logger.info(f"MQTT 서버가 {self.host}:{self.port}에서 시작되었습니다.")
-            logger.info(f"다른 기기에서 접속하려면: {self.get_local_ip()}:{self.port}")
+            for listener in self.listeners[1:]:
+                logger.info(f"추가 리스너: {listener.name}")
             
             while self.running:
                 try:
-                    client_socket, address = self.server_socket.accept()
-                    logger.info(f"새로운 클라이언트 연결: {address}")
-                    
-                    # 새 클라이언트 스레드 시작
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
+                    for key, _ in self.selector.select(timeout=0.5):
+                        listener = key.data
+                        while self.running:
+                            accepted = listener.accept()
+                            if accepted is None:
+                                break
+                            client_socket, address = accepted
+                            logger.info(f"새로운 클라이언트 연결: {address} ({listener.name})")
+                            
+                            # 새 클라이언트 스레드 시작 (TLS/웹소켓 핸드셰이크는 스레드에서 수행)
+                            client_thread = threading.Thread(
+                                target=self.handle_client,
+                                args=(client_socket, address, listener)
+                            )
+                            client_thread.daemon = True
+                            client_thread.start()
                     
                 except Exception as e:
                     if self.running:
@@ -61,21 +497,36 @@ class MQTTServer:
         finally:
             self.stop()
     
+    def sweep_sessions(self):
+        """만료된 오프라인 세션 정리 루프 (서버가 멈출 때까지)"""
+        while not self.sweep_stopped.wait(self.session_sweep_interval):
+            try:
+                self.offline_store.expire_sessions()
+            except Exception as e:
+                logger.error(f"세션 만료 정리 오류: {e}")
+    
     def get_local_ip(self):
-        """로컬 IP 주소 가져오기"""
+        """로컬 IP 주소 가져오기 (외부 네트워크에 연결하지 않음)"""
+        if self.host not in ('0.0.0.0', ''):
+            return self.host
         try:
-            # 외부 연결을 시도하여 로컬 IP 확인
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip
+            # 호스트 이름으로 확인 (보통 /etc/hosts에서 바로 응답)
+            return socket.gethostbyname(socket.gethostname())
         except Exception:
             return "127.0.0.1"
     
     def stop(self):
         """MQTT 서버 중지"""
+        # 클라이언트 연결을 끊기 전에 현재 세션 상태 저장 (이미 중지된 경우 제외)
+        if self.running and self.snapshot_path:
+            self.save_snapshot()
         self.running = False
+        self.sweep_stopped.set()
+        for listener in self.listeners:
+            listener.close()
+        if self.selector:
+            self.selector.close()
+            self.selector = None
         if self.server_socket:
             self.server_socket.close()
         
@@ -83,10 +534,24 @@ class MQTTServer:
         for client_id, client in list(self.clients.items()):
             client.disconnect()
         
+        # 배치 플러시 스레드, 오프라인 큐와 스풀 파일 정리
+        self.batcher.stop()
+        self.offline_store.shutdown()
+        
         logger.info("MQTT 서버가 중지되었습니다.")
     
-    def handle_client(self, client_socket, address):
+    def handle_client(self, client_socket, address, listener: Optional[Listener] = None):
         """클라이언트 연결 처리"""
+        if listener is not None:
+            try:
+                client_socket = listener.wrap(client_socket, self)
+            except Exception as e:
+                logger.error(f"클라이언트 {address} 핸드셰이크 실패 ({listener.name}): {e}")
+                client_socket.close()
+                return
+            if not listener.handles_mqtt:
+                listener.serve(client_socket, self)
+                return
         client = MQTTClient(client_socket, address, self)
         try:
             client.handle_connection()
@@ -95,84 +560,426 @@ class MQTTServer:
         finally:
             client.disconnect()
     
+    def save_snapshot(self, path: Optional[str] = None):
+        """영속 세션 구독과 보관 메시지를 스냅샷으로 저장"""
+        path = path or self.snapshot_path
+        try:
+            return write_snapshot(self, path)
+        except Exception as e:
+            logger.error(f"스냅샷 저장 실패 ({path}): {e}")
+            return None
+    
+    def load_snapshot(self, path: Optional[str] = None):
+        """스냅샷에서 영속 세션 구독과 보관 메시지 복원"""
+        path = path or self.snapshot_path
+        try:
+            return read_snapshot(self, path)
+        except Exception as e:
+            logger.error(f"스냅샷 복원 실패 ({path}): {e}")
+            return None
+    
+    def persistent_sessions(self) -> list:
+        """스냅샷에 저장할 영속 세션 목록 -> [(클라이언트 ID, 세션 만료 간격, 구독), ...]
+
+        연결 중인 세션은 전체 만료 간격, 오프라인 세션은 남은 시간을 저장한다.
+        브리지 링크와 Clean Session 클라이언트는 재연결 시 다시 구독하므로 제외한다.
+        """
+        now = time.monotonic()
+        sessions = {}
+        with self.offline_store.lock:
+            queues = list(self.offline_store.queues.values())
+        for queue in queues:
+            if queue.expired(now):
+                continue
+            if queue.expires_at is None:
+                expiry_interval = SESSION_NEVER_EXPIRES
+            else:
+                expiry_interval = max(1, int(queue.expires_at - now))
+            sessions[queue.client_id] = (queue.client_id, expiry_interval, tuple(queue.subscriptions))
+        for client_id, client in list(self.clients.items()):
+            if client.session_expiry_interval and not is_bridge_client(client_id):
+                sessions[client_id] = (client_id, client.session_expiry_interval, tuple(client.subscriptions))
+        return list(sessions.values())
+    
     def add_client(self, client_id: str, client: 'MQTTClient'):
-        """클라이언트 추가"""
+        """클라이언트 추가 (drain_session이 오프라인 큐 잠금 안에서 호출)"""
         self.clients[client_id] = client
         logger.info(f"클라이언트 추가됨: {client_id}")
     
-    def remove_client(self, client_id: str):
-        """클라이언트 제거"""
-        if client_id in self.clients:
+    def remove_client(self, client_id: str, client: Optional['MQTTClient'] = None):
+        """클라이언트 제거
+
+        클라이언트 목록 변경은 오프라인 큐 잠금 안에서 하므로, 영속 세션은
+        큐를 연 뒤에 목록에서 빠지고 그 사이 발행된 메시지도 큐에 들어간다.
+        """
+        with self.offline_store.lock:
+            if client is None:
+                client = self.clients.get(client_id)
+            # 같은 ID로 다시 연결한 새 클라이언트는 건드리지 않음
+            if client is None or self.clients.get(client_id) is not client:
+                return
+            if client.session_expiry_interval:
+                # 영속 세션: 구독은 유지하고 이후 메시지는 오프라인 큐에 보관
+                expires_at = None
+                if client.session_expiry_interval != SESSION_NEVER_EXPIRES:
+                    expires_at = time.monotonic() + client.session_expiry_interval
+                self.offline_store.open(client_id, client.subscriptions, expires_at)
             del self.clients[client_id]
-            logger.info(f"클라이언트 제거됨: {client_id}")
+        logger.info(f"클라이언트 제거됨: {client_id}")
+        
+        if not client.session_expiry_interval:
+            for topic in client.subscriptions:
+                self.unsubscribe(client_id, topic)
+    
+    def take_over(self, client: 'MQTTClient') -> Optional[tuple]:
+        """같은 ID로 이미 연결된 클라이언트를 끊고 그 구독 반환
+
+        이전 연결이 없거나 세션이 연결과 함께 끝나는 Clean Session이면 None이며,
+        이때 이전 구독은 제거해 새 연결이 이어받지 않게 한다.
+        """
+        with self.offline_store.lock:
+            previous = self.clients.get(client.client_id)
+            if previous is None or previous is client:
+                return None
+            if previous.session_expiry_interval:
+                # 새 클라이언트가 등록될 때까지 발행된 메시지를 받아 둘 큐를 먼저 연 뒤 교체
+                # (drain_session이 새 클라이언트에게 전달하거나 Clean Session이면 버림)
+                self.offline_store.open(client.client_id, previous.subscriptions, None)
+            del self.clients[client.client_id]
+        previous.disconnect()
+        logger.info(f"기존 연결 대체: {client.client_id}")
+        if not previous.session_expiry_interval:
+            for topic in previous.subscriptions:
+                self.unsubscribe(client.client_id, topic)
+            return None
+        return previous.subscriptions
+    
+    def resume_session(self, client: 'MQTTClient') -> bool:
+        """영속 세션 복원: 구독 복원 여부 반환 (큐 전달은 drain_session)"""
+        queue = self.offline_store.get(client.client_id)
+        if queue is None:
+            return False
+        client.subscriptions = queue.subscriptions
+        return True
+    
+    def drain_session(self, client: 'MQTTClient'):
+        """오프라인 큐를 일괄 전달한 뒤 클라이언트를 온라인으로 등록"""
+        self.offline_store.drain(
+            client.client_id,
+            client.deliver_batch,
+            lambda: self.add_client(client.client_id, client),
+        )
+    
+    def end_session(self, queue):
+        """세션 종료 (Clean Session 재연결 또는 세션 만료): 구독 제거"""
+        for topic in queue.subscriptions:
+            self.unsubscribe(queue.client_id, topic)
     
     def subscribe(self, client_id: str, topic: str):
-        """클라이언트 구독"""
+        """클라이언트 구독 (배치 구독 필터 형식이 잘못되면 ValueError)"""
+        batch_spec = parse_batch_filter(topic)
+        with self.subscription_lock:
+            self._add_subscription(client_id, topic, batch_spec)
+        logger.info(f"구독: {client_id} -> {topic}")
+    
+    def subscribe_many(self, entries) -> int:
+        """(클라이언트 ID, 필터) 목록 일괄 구독 (스냅샷 복원용, 항목별 로그 없음)
+
+        필터 문자열은 호출하는 쪽에서 intern 해서 넘긴다.
+        """
+        count = 0
+        subscriptions = self.subscriptions
+        wildcard_filters = self.wildcard_filters
+        local_filters = self.local_filters
+        added_filters = []
+        with self.subscription_lock:
+            for client_id, topic in entries:
+                # 배치 구독과 브리지 링크는 일반 경로로 처리
+                if topic.startswith(BATCH_PREFIX) or client_id.startswith(BRIDGE_CLIENT_PREFIX):
+                    try:
+                        self._add_subscription(client_id, topic, parse_batch_filter(topic))
+                        count += 1
+                    except ValueError as e:
+                        logger.error(f"구독 복원 실패: {e}")
+                    continue
+                subscribers = subscriptions.get(topic)
+                if subscribers is None:
+                    subscriptions[topic] = {client_id}
+                    if '+' in topic or '#' in topic:
+                        wildcard_filters[topic] = tuple(topic.split('/'))
+                elif client_id in subscribers:
+                    continue
+                else:
+                    subscribers.add(client_id)
+                local_count = local_filters.get(topic, 0) + 1
+                local_filters[topic] = local_count
+                if local_count == 1:
+                    added_filters.append(topic)
+                count += 1
+            self.subscription_generation += 1
+            if added_filters:
+                for bridge in self.bridges:
+                    bridge.filters_added(added_filters)
+        logger.info(f"구독 일괄 복원: {count}개")
+        return count
+    
+    def _add_subscription(self, client_id: str, topic: str, batch_spec: Optional[BatchSpec]):
+        """구독 색인에 추가 (구독 잠금 안에서 호출)"""
         if topic not in self.subscriptions:
             self.subscriptions[topic] = set()
-        self.subscriptions[topic].add(client_id)
-        logger.info(f"구독: {client_id} -> {topic}")
+            if batch_spec is not None:
+                # 배치 구독은 안쪽 필터로 매칭 (와일드카드가 없어도 필터 목록에서 검사)
+                self.batch_filters[topic] = batch_spec
+                self.wildcard_filters[topic] = tuple(batch_spec.topic_filter.split('/'))
+            elif '+' in topic or '#' in topic:
+                self.wildcard_filters[topic] = tuple(topic.split('/'))
+            self.subscription_generation += 1
+        subscribers = self.subscriptions[topic]
+        if client_id not in subscribers:
+            subscribers.add(client_id)
+            # 로컬 구독자가 처음 생긴 필터는 브리지 피어에게 알림 (배치 구독은 안쪽 필터)
+            if not is_bridge_client(client_id):
+                bridge_filter = batch_spec.topic_filter if batch_spec is not None else topic
+                count = self.local_filters.get(bridge_filter, 0) + 1
+                self.local_filters[bridge_filter] = count
+                if count == 1:
+                    for bridge in self.bridges:
+                        bridge.filter_added(bridge_filter)
     
     def unsubscribe(self, client_id: str, topic: str):
         """클라이언트 구독 해제"""
-        if topic in self.subscriptions and client_id in self.subscriptions[topic]:
+        with self.subscription_lock:
+            if topic not in self.subscriptions or client_id not in self.subscriptions[topic]:
+                return
             self.subscriptions[topic].remove(client_id)
-            logger.info(f"구독 해제: {client_id} -> {topic}")
+            batch_spec = self.batch_filters.get(topic)
+            if not self.subscriptions[topic]:
+                del self.subscriptions[topic]
+                self.wildcard_filters.pop(topic, None)
+                self.batch_filters.pop(topic, None)
+                self.subscription_generation += 1
+            # 로컬 구독자가 모두 사라진 필터는 브리지 피어에게 알림
+            if not is_bridge_client(client_id):
+                bridge_filter = batch_spec.topic_filter if batch_spec is not None else topic
+                count = self.local_filters.get(bridge_filter, 0) - 1
+                if count > 0:
+                    self.local_filters[bridge_filter] = count
+                else:
+                    self.local_filters.pop(bridge_filter, None)
+                    for bridge in self.bridges:
+                        bridge.filter_removed(bridge_filter)
+        if batch_spec is not None:
+            self.batcher.discard(client_id, topic)
+        logger.info(f"구독 해제: {client_id} -> {topic}")
+    
+    def attach_bridge(self, bridge, send_summary):
+        """브리지 링크 연결: 로컬 구독 요약을 보내고 이후 변경을 알리도록 등록
+
+        구독 잠금 안에서 요약과 등록을 함께 링크 송신 큐에 넣으므로 변경 알림이
+        요약보다 먼저 피어에 도착하지 않는다 (실제 전송은 잠금 밖의 송신 스레드).
+        """
+        with self.subscription_lock:
+            send_summary(list(self.local_filters))
+            if bridge not in self.bridges:
+                self.bridges.append(bridge)
+    
+    def detach_bridge(self, bridge):
+        """브리지 링크 연결 해제"""
+        with self.subscription_lock:
+            if bridge in self.bridges:
+                self.bridges.remove(bridge)
     
-    def publish(self, topic: str, message: str, qos: int = 0):
-        """메시지 발행"""
-        if topic in self.subscriptions:
-            for client_id in self.subscriptions[topic]:
-                if client_id in self.clients:
-                    self.clients[client_id].send_message(topic, message, qos)
-            logger.info(f"메시지 발행: {topic} -> {message}")
+    def retain(self, topic: Topic, message, qos: int = 0, properties: Properties = EMPTY_PROPERTIES):
+        """보관 메시지 저장 (빈 페이로드면 삭제)"""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if not message:
+            self.retained.pop(topic.name, None)
+            logger.info(f"보관 메시지 삭제: {topic.name}")
+            return
+        self.retained[topic.name] = Message(topic, message, qos, properties, retain=1)
+        logger.info(f"보관 메시지 저장: {topic.name}")
+
+    def retained_messages(self, topic_filter: str) -> list:
+        """구독 필터와 일치하는 보관 메시지 목록 (만료된 메시지는 제거)"""
+        if '+' not in topic_filter and '#' not in topic_filter:
+            message = self.retained.get(topic_filter)
+            candidates = [message] if message is not None else []
+        else:
+            filter_levels = tuple(topic_filter.split('/'))
+            candidates = [message for message in list(self.retained.values())
+                          if topic_matches(filter_levels, message.topic.levels)]
+        now = time.monotonic()
+        matched = []
+        for message in candidates:
+            if message.expired(now):
+                self.retained.pop(message.topic.name, None)
+            else:
+                matched.append(message)
+        return matched
+    
+    def deliver_batch_frame(self, client_id: str, frame: bytes):
+        """배치 프레임을 구독자에게 전달 (오프라인 영속 세션이면 큐에 보관)"""
+        self.deliver_to(client_id, Message(self.topics.get(BATCH_TOPIC), frame))
+    
+    def deliver_to(self, client_id: str, message: Message) -> bool:
+        """온라인 클라이언트에게 전달하거나 오프라인 큐에 보관 (둘 다 없으면 False)
+
+        재연결한 클라이언트는 큐 잠금 안에서 등록된 뒤 큐가 제거되므로,
+        큐에 넣지 못했으면 클라이언트 목록을 다시 확인해야 메시지가 유실되지 않는다.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            if self.offline_store.append(client_id, message):
+                return True
+            client = self.clients.get(client_id)
+            if client is None:
+                return False
+        client.deliver(message)
+        return True
+    
+    def match_filters(self, topic: Topic):
+        """토픽과 일치하는 구독 필터 목록 (구독이 바뀌기 전까지 Topic에 캐시)"""
+        generation = self.subscription_generation
+        if topic.match_generation != generation:
+            # 배치 구독 필터는 wildcard_filters에서 안쪽 필터로만 매칭
+            matched = [topic.name] if (topic.name in self.subscriptions
+                                       and topic.name not in self.batch_filters) else []
+            for topic_filter, filter_levels in list(self.wildcard_filters.items()):
+                if topic_matches(filter_levels, topic.levels):
+                    matched.append(topic_filter)
+            topic.matched_filters = tuple(matched)
+            topic.match_generation = generation
+        return topic.matched_filters
+    
+    def publish(self, topic, message, qos: int = 0, properties: Properties = EMPTY_PROPERTIES,
+                from_bridge: bool = False, trace=None, retain: bool = False):
+        """메시지 발행 (브리지로 받은 메시지는 다른 피어로 다시 전달하지 않음)"""
+        if not isinstance(topic, Topic):
+            topic = self.topics.get(topic)
+        if retain:
+            self.retain(topic, message, qos, properties)
+        matched_filters = self.match_filters(topic)
+        if trace is not None:
+            trace.mark('match')
+        if matched_filters:
+            # 구독자마다 다시 인코딩하지 않도록 한 번만 인코딩
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+            routed = Message(topic, message, qos, properties)
+            routed.trace = trace
+            # 여러 필터에 매칭되더라도 클라이언트당 한 번만 전달
+            client_ids = set()
+            batch_filters = self.batch_filters
+            for topic_filter in matched_filters:
+                subscribers = self.subscriptions.get(topic_filter, ())
+                if batch_filters and topic_filter in batch_filters:
+                    # 배치 구독자는 즉시 보내지 않고 배치에 모음
+                    self.batcher.add(batch_filters[topic_filter], tuple(subscribers), routed)
+                    if trace is not None:
+                        trace.mark('enqueue')
+                    continue
+                client_ids.update(subscribers)
+            for client_id in client_ids:
+                if from_bridge and is_bridge_client(client_id):
+                    continue
+                # 연결이 끊긴 영속 세션이면 오프라인 큐에 보관
+                self.deliver_to(client_id, routed)
+            if trace is not None:
+                trace.mark('enqueue')
+            # 오프라인 큐에 남은 메시지가 트레이스를 붙잡지 않도록 해제
+            routed.trace = None
+            logger.info(f"메시지 발행: {topic.name} ({len(message)} bytes)")
+        if trace is not None:
+            trace.finish()
 
 class MQTTClient:
+    # 10만 개의 유휴 연결을 목표로 연결당 상태를 최소화한다.
+    # 읽기/쓰기 버퍼는 패킷을 처리하는 동안에만 버퍼 풀에서 빌려 쓴다.
+    __slots__ = ('socket', 'address', 'server', 'client_id', 'subscriptions',
+                 'connected', 'write_lock', 'protocol_level', 'topic_alias_maximum',
+                 'inbound_aliases', 'outbound_aliases', 'maximum_packet_size',
+                 'session_expiry_interval')
+
     def __init__(self, socket, address, server):
         self.socket = socket
         self.address = address
         self.server = server
         self.client_id = None
-        self.subscriptions = set()
+        # 구독 토픽은 intern 된 문자열의 튜플로 보관 (빈 튜플은 추가 메모리 없음)
+        # 구독이 많아지면 add_subscription이 집합으로 바꿈
+        self.subscriptions = ()
         self.connected = False
-        
+        self.write_lock = threading.Lock()
+        self.protocol_level = 4
+        # MQTT 5 토픽 별칭 (사용하는 클라이언트에 한해 처음 사용할 때 생성)
+        self.topic_alias_maximum = 0
+        self.inbound_aliases: Optional[Dict[int, Topic]] = None
+        # 송신 별칭은 인코딩된 토픽으로 찾음 (토픽 테이블이 가득 차 매번 새로 만든 Topic도 같은 별칭 사용)
+        self.outbound_aliases: Optional[Dict[bytes, int]] = None
+        # MQTT 5 클라이언트가 받을 수 있는 최대 패킷 크기 (None = 제한 없음)
+        self.maximum_packet_size = None
+        # 세션 만료 간격 (0 = 연결 종료 시 세션 삭제)
+        self.session_expiry_interval = 0
+
     def handle_connection(self):
         """클라이언트 연결 처리"""
         try:
             while self.server.running:
                 # 패킷 헤더 읽기
-                packet_type, remaining_length = self.read_packet_header()
-                
-                if packet_type == 1:  # CONNECT
-                    if self.handle_connect():
-                        self.connected = True
-                        logger.info(f"클라이언트 {self.client_id} 연결 성공")
-                    else:
-                        logger.error(f"클라이언트 {self.address} 연결 실패")
-                        break
-                        
-                elif packet_type == 3:  # PUBLISH
-                    self.handle_publish()
-                    
-                elif packet_type == 8:  # SUBSCRIBE
-                    self.handle_subscribe()
-                    
-                elif packet_type == 10:  # UNSUBSCRIBE
-                    self.handle_unsubscribe()
-                    
-                elif packet_type == 12:  # PINGREQ
-                    self.handle_pingreq()
-                    
-                elif packet_type == 14:  # DISCONNECT
-                    self.handle_disconnect()
+                packet_type, flags, remaining_length = self.read_packet_header()
+                if packet_size(remaining_length) > self.server.maximum_packet_size:
+                    logger.error(f"클라이언트 {self.address} 최대 패킷 크기 초과: "
+                                 f"{packet_size(remaining_length)} bytes")
+                    if self.protocol_level == 5 and self.connected:
+                        self.send_packet(DISCONNECT_PACKET_TOO_LARGE)
                     break
-                    
+                # 1/N PUBLISH만 단계별 시각 기록 (꺼져 있으면 비교 한 번)
+                trace = None
+                if packet_type == 3 and self.server.tracer.sample_rate:
+                    trace = self.server.tracer.sample()
+
+                # 패킷 본문을 풀에서 빌린 버퍼로 한 번에 읽기
+                buffer = self.server.buffer_pool.acquire(remaining_length)
+                try:
+                    body = memoryview(buffer)[:remaining_length]
+                    self.recv_exact_into(body)
+                    if trace is not None:
+                        trace.mark('read')
+
+                    if packet_type == 1:  # CONNECT
+                        if self.handle_connect(body):
+                            self.connected = True
+                            logger.info(f"클라이언트 {self.client_id} 연결 성공")
+                        else:
+                            logger.error(f"클라이언트 {self.address} 연결 실패")
+                            break
+
+                    elif packet_type == 3:  # PUBLISH
+                        self.handle_publish(flags, body, trace)
+
+                    elif packet_type == 8:  # SUBSCRIBE
+                        self.handle_subscribe(body)
+
+                    elif packet_type == 10:  # UNSUBSCRIBE
+                        self.handle_unsubscribe(body)
+
+                    elif packet_type == 12:  # PINGREQ
+                        self.handle_pingreq()
+
+                    elif packet_type == 14:  # DISCONNECT
+                        self.handle_disconnect()
+                        break
+                finally:
+                    body = None
+                    self.server.buffer_pool.release(buffer)
+
         except Exception as e:
             logger.error(f"클라이언트 {self.address} 처리 중 오류: {e}")
         finally:
             if self.client_id:
-                self.server.remove_client(self.client_id)
-    
+                self.server.remove_client(self.client_id, self)
+
     def read_packet_header(self):
         """패킷 헤더 읽기"""
         try:
@@ -180,220 +987,287 @@ class MQTTClient:
             first_byte = self.socket.recv(1)
             if not first_byte:
                 raise Exception("연결이 끊어졌습니다")
-            
+
             packet_type = (first_byte[0] >> 4) & 0x0F
-            
+            flags = first_byte[0] & 0x0F
+
             # 나머지 길이 읽기
             remaining_length = self.read_remaining_length()
-            
-            return packet_type, remaining_length
-            
+
+            return packet_type, flags, remaining_length
+
         except Exception as e:
             logger.error(f"패킷 헤더 읽기 오류: {e}")
             raise
-    
+
     def read_remaining_length(self):
         """나머지 길이 읽기"""
         multiplier = 1
         value = 0
-        
+
         while True:
             byte = self.socket.recv(1)
             if not byte:
                 raise Exception("연결이 끊어졌습니다")
-            
+
             byte_val = byte[0]
             value += (byte_val & 0x7F) * multiplier
-            
+
             if (byte_val & 0x80) == 0:
                 break
-                
+
             multiplier *= 128
-            
+
             if multiplier > 128 * 128 * 128:
                 raise Exception("나머지 길이가 너무 큽니다")
-        
+
         return value
-    
-    def handle_connect(self):
+
+    def recv_exact_into(self, view: memoryview):
+        """버퍼가 가득 찰 때까지 수신"""
+        received = 0
+        total = len(view)
+        while received < total:
+            count = self.socket.recv_into(view[received:])
+            if count == 0:
+                raise Exception("연결이 끊어졌습니다")
+            received += count
+
+    def handle_connect(self, body: memoryview):
         """CONNECT 패킷 처리"""
         try:
-            # 프로토콜 이름 길이 읽기
-            protocol_name_length_bytes = self.socket.recv(2)
-            if len(protocol_name_length_bytes) < 2:
-                logger.error("프로토콜 이름 길이를 읽을 수 없습니다.")
-                return False
-            protocol_name_length = int.from_bytes(protocol_name_length_bytes, 'big')
-            
             # 프로토콜 이름 읽기
-            protocol_name_bytes = self.socket.recv(protocol_name_length)
-            if len(protocol_name_bytes) < protocol_name_length:
-                logger.error("프로토콜 이름을 읽을 수 없습니다.")
-                return False
-            protocol_name = protocol_name_bytes.decode('utf-8')
-            
-            # 프로토콜 레벨 읽기
-            protocol_level_bytes = self.socket.recv(1)
-            if len(protocol_level_bytes) < 1:
-                logger.error("프로토콜 레벨을 읽을 수 없습니다.")
-                return False
-            protocol_level = protocol_level_bytes[0]
-            
-            # 연결 플래그 읽기
-            connect_flags_bytes = self.socket.recv(1)
-            if len(connect_flags_bytes) < 1:
-                logger.error("연결 플래그를 읽을 수 없습니다.")
-                return False
-            connect_flags = connect_flags_bytes[0]
-            
-            # Keep Alive 읽기
-            keep_alive_bytes = self.socket.recv(2)
-            if len(keep_alive_bytes) < 2:
-                logger.error("Keep Alive를 읽을 수 없습니다.")
-                return False
-            keep_alive = int.from_bytes(keep_alive_bytes, 'big')
-            
-            # 클라이언트 ID 길이 읽기
-            client_id_length_bytes = self.socket.recv(2)
-            if len(client_id_length_bytes) < 2:
-                logger.error("클라이언트 ID 길이를 읽을 수 없습니다.")
+            protocol_name, offset = read_utf8_string(body, 0)
+
+            # 프로토콜 레벨, 연결 플래그, Keep Alive 읽기
+            if len(body) < offset + 4:
+                logger.error("CONNECT 가변 헤더를 읽을 수 없습니다.")
                 return False
-            client_id_length = int.from_bytes(client_id_length_bytes, 'big')
-            
-            # 클라이언트 ID 읽기
-            client_id_bytes = self.socket.recv(client_id_length)
-            if len(client_id_bytes) < client_id_length:
-                logger.error("클라이언트 ID를 읽을 수 없습니다.")
+            protocol_level = body[offset]
+            connect_flags = body[offset + 1]
+            keep_alive = int.from_bytes(body[offset + 2:offset + 4], 'big')
+            offset += 4
+            self.protocol_level = protocol_level
+
+            clean_session = bool(connect_flags & 0x02)
+
+            # MQTT 5 속성
+            if protocol_level == 5:
+                properties, offset = read_properties(body, offset)
+                self.topic_alias_maximum = properties.get(PROPERTY_TOPIC_ALIAS_MAXIMUM, 0)
+                self.maximum_packet_size = properties.get(PROPERTY_MAXIMUM_PACKET_SIZE)
+                self.session_expiry_interval = properties.get(PROPERTY_SESSION_EXPIRY_INTERVAL, 0)
+            elif protocol_level in (3, 4):
+                # MQTT 3.1.1: Clean Session 0이면 세션을 만료 없이 유지
+                self.session_expiry_interval = 0 if clean_session else SESSION_NEVER_EXPIRES
+            else:
+                logger.error(f"지원하지 않는 프로토콜 레벨: {protocol_level}")
                 return False
-            self.client_id = client_id_bytes.decode('utf-8')
-            
+
+            # 클라이언트 ID 읽기 (비어 있으면 서버가 할당)
+            self.client_id, offset = read_utf8_string(body, offset)
+            assigned_client_id = None
+            if not self.client_id:
+                self.client_id = assigned_client_id = f"auto-{uuid.uuid4().hex}"
+
             logger.info(f"CONNECT: 프로토콜={protocol_name}, 레벨={protocol_level}, 클라이언트ID={self.client_id}")
-            
-            # 서버에 클라이언트 추가
-            self.server.add_client(self.client_id, self)
-            
+
+            # 같은 ID로 연결된 이전 클라이언트를 끊고, 이전 세션 정리 또는 복원
+            session_present = False
+            taken_over = self.server.take_over(self)
+            if clean_session:
+                for topic in taken_over or ():
+                    self.server.unsubscribe(self.client_id, topic)
+                previous = self.server.offline_store.close(self.client_id)
+                if previous is not None:
+                    self.server.end_session(previous)
+            elif taken_over is not None:
+                self.subscriptions = taken_over
+                session_present = True
+            else:
+                session_present = self.server.resume_session(self)
+
             # CONNACK 응답 전송
-            self.send_connack()
-            
+            self.send_connack(assigned_client_id, session_present)
+
+            # 서버에 클라이언트 추가 (보관된 메시지가 있으면 먼저 일괄 전달)
+            self.server.drain_session(self)
+
             return True
-            
+
         except Exception as e:
             logger.error(f"CONNECT 패킷 처리 오류: {e}")
             return False
-    
-    def handle_publish(self):
+
+    def handle_publish(self, flags: int, body: memoryview, trace=None):
         """PUBLISH 패킷 처리"""
         try:
-            # 토픽 이름 길이 읽기
-            topic_length_bytes = self.socket.recv(2)
-            if len(topic_length_bytes) < 2:
+            # 토픽 이름 위치 확인 (디코딩은 intern 테이블에 없을 때만)
+            if len(body) < 2:
                 logger.error("토픽 길이를 읽을 수 없습니다.")
                 return
-            topic_length = int.from_bytes(topic_length_bytes, 'big')
-            
-            # 토픽 이름 읽기
-            topic_bytes = self.socket.recv(topic_length)
-            if len(topic_bytes) < topic_length:
+            topic_length = (body[0] << 8) | body[1]
+            offset = 2 + topic_length
+            if len(body) < offset:
                 logger.error("토픽을 읽을 수 없습니다.")
                 return
-            topic = topic_bytes.decode('utf-8')
-            
+            topic = self.server.topics.lookup(body[2:offset]) if topic_length else None
+
             # 메시지 ID 읽기 (QoS > 0인 경우)
+            qos = (flags >> 1) & 0x03
             message_id = None
-            if hasattr(self, 'qos') and self.qos > 0:
-                message_id_bytes = self.socket.recv(2)
-                if len(message_id_bytes) >= 2:
-                    message_id = int.from_bytes(message_id_bytes, 'big')
-            
-            # 페이로드 읽기
-            payload = self.socket.recv(1024).decode('utf-8')
-            
-            logger.info(f"PUBLISH: 토픽={topic}, 메시지={payload}")
-            
+            if qos > 0:
+                message_id = int.from_bytes(body[offset:offset + 2], 'big')
+                offset += 2
+
+            # MQTT 5 속성 (값은 필요할 때만 디코딩) 및 토픽 별칭 처리
+            properties = EMPTY_PROPERTIES
+            if self.protocol_level == 5:
+                properties, offset = read_properties(body, offset)
+                alias = properties.get(PROPERTY_TOPIC_ALIAS)
+                if alias is not None:
+                    topic = self.resolve_inbound_alias(alias, topic)
+                    if topic is None:
+                        return
+            if topic is None:
+                logger.error("토픽이 비어 있습니다.")
+                return
+
+            # 페이로드 읽기 (버퍼는 재사용되므로 복사)
+            payload = bytes(body[offset:])
+
+            logger.info(f"PUBLISH: 토픽={topic.name}, 크기={len(payload)}")
+            if trace is not None:
+                trace.mark('decode')
+
             # 구독자들에게 메시지 전달
-            self.server.publish(topic, payload)
-            
+            self.server.publish(topic, payload, properties=properties, trace=trace,
+                                retain=bool(flags & 0x01))
+
+            # QoS 1은 전달 직후 PUBACK (수신 중인 QoS 1 메시지는 항상 1개 이하)
+            if qos == 1:
+                self.send_puback(message_id)
+
         except Exception as e:
             logger.error(f"PUBLISH 패킷 처리 오류: {e}")
-    
-    def handle_subscribe(self):
+
+    def resolve_inbound_alias(self, alias: int, topic: Optional[Topic]):
+        """수신 토픽 별칭 등록/조회"""
+        if alias == 0 or alias > self.server.topic_alias_maximum:
+            logger.error(f"허용되지 않는 토픽 별칭: {alias}")
+            return None
+        if topic is not None:
+            if self.inbound_aliases is None:
+                self.inbound_aliases = {}
+            self.inbound_aliases[alias] = topic
+            return topic
+        topic = self.inbound_aliases.get(alias) if self.inbound_aliases else None
+        if topic is None:
+            logger.error(f"등록되지 않은 토픽 별칭: {alias}")
+        return topic
+
+    def handle_subscribe(self, body: memoryview):
         """SUBSCRIBE 패킷 처리"""
         try:
             # 메시지 ID 읽기
-            message_id_bytes = self.socket.recv(2)
-            if len(message_id_bytes) < 2:
+            if len(body) < 2:
                 logger.error("메시지 ID를 읽을 수 없습니다.")
                 return
-            message_id = int.from_bytes(message_id_bytes, 'big')
-            
-            # 토픽 필터 길이 읽기
-            topic_filter_length_bytes = self.socket.recv(2)
-            if len(topic_filter_length_bytes) < 2:
-                logger.error("토픽 필터 길이를 읽을 수 없습니다.")
-                return
-            topic_filter_length = int.from_bytes(topic_filter_length_bytes, 'big')
-            
-            # 토픽 필터 읽기
-            topic_filter_bytes = self.socket.recv(topic_filter_length)
-            if len(topic_filter_bytes) < topic_filter_length:
-                logger.error("토픽 필터를 읽을 수 없습니다.")
-                return
-            topic_filter = topic_filter_bytes.decode('utf-8')
-            
-            # QoS 읽기
-            qos_bytes = self.socket.recv(1)
-            if len(qos_bytes) < 1:
-                logger.error("QoS를 읽을 수 없습니다.")
-                return
-            qos = qos_bytes[0]
-            
-            # 구독 처리
-            self.server.subscribe(self.client_id, topic_filter)
-            self.subscriptions.add(topic_filter)
-            
-            # SUBACK 응답 전송
-            self.send_suback(message_id, qos)
-            
-            logger.info(f"SUBSCRIBE: 토픽={topic_filter}, QoS={qos}")
-            
+            message_id = int.from_bytes(body[0:2], 'big')
+            offset = 2
+            if self.protocol_level == 5:
+                offset = skip_properties(body, offset)
+
+            # 토픽 필터와 QoS 목록 읽기
+            granted = bytearray()
+            retained = []
+            while offset < len(body):
+                topic_filter, offset = read_utf8_string(body, offset)
+                if offset >= len(body):
+                    logger.error("QoS를 읽을 수 없습니다.")
+                    return
+                options = body[offset]
+                qos = options & 0x03
+                offset += 1
+                # MQTT 5 Retain Handling: 0 = 항상, 1 = 새 구독일 때만, 2 = 보내지 않음
+                retain_handling = (options >> 4) & 0x03 if self.protocol_level == 5 else 0
+                existing = topic_filter in self.subscriptions
+
+                # 구독 처리 (잘못된 배치 구독은 0x80 실패 코드)
+                topic_filter = sys.intern(topic_filter)
+                try:
+                    self.server.subscribe(self.client_id, topic_filter)
+                except ValueError as e:
+                    logger.error(f"구독 거부: {e}")
+                    granted.append(0x80)
+                    continue
+                self.add_subscription(topic_filter)
+                granted.append(min(qos, MAXIMUM_QOS))
+                if self.server.retained and (retain_handling == 0 or (retain_handling == 1 and not existing)) \
+                        and topic_filter not in self.server.batch_filters:
+                    retained.extend(self.server.retained_messages(topic_filter))
+
+                logger.info(f"SUBSCRIBE: 토픽={topic_filter}, QoS={qos}")
+
+            # SUBACK 응답 전송 후 일치하는 보관 메시지 전달
+            self.send_suback(message_id, granted)
+            if retained:
+                self.deliver_batch(retained)
+
         except Exception as e:
             logger.error(f"SUBSCRIBE 패킷 처리 오류: {e}")
-    
-    def handle_unsubscribe(self):
+
+    def handle_unsubscribe(self, body: memoryview):
         """UNSUBSCRIBE 패킷 처리"""
         try:
             # 메시지 ID 읽기
-            message_id_bytes = self.socket.recv(2)
-            if len(message_id_bytes) < 2:
+            if len(body) < 2:
                 logger.error("메시지 ID를 읽을 수 없습니다.")
                 return
-            message_id = int.from_bytes(message_id_bytes, 'big')
-            
-            # 토픽 필터 길이 읽기
-            topic_filter_length_bytes = self.socket.recv(2)
-            if len(topic_filter_length_bytes) < 2:
-                logger.error("토픽 필터 길이를 읽을 수 없습니다.")
-                return
-            topic_filter_length = int.from_bytes(topic_filter_length_bytes, 'big')
-            
-            # 토픽 필터 읽기
-            topic_filter_bytes = self.socket.recv(topic_filter_length)
-            if len(topic_filter_bytes) < topic_filter_length:
-                logger.error("토픽 필터를 읽을 수 없습니다.")
-                return
-            topic_filter = topic_filter_bytes.decode('utf-8')
-            
-            # 구독 해제 처리
-            self.server.unsubscribe(self.client_id, topic_filter)
-            self.subscriptions.discard(topic_filter)
-            
+            message_id = int.from_bytes(body[0:2], 'big')
+            offset = 2
+            if self.protocol_level == 5:
+                offset = skip_properties(body, offset)
+
+            # 토픽 필터 목록 읽기
+            reason_codes = bytearray()
+            while offset < len(body):
+                topic_filter, offset = read_utf8_string(body, offset)
+
+                # 구독 해제 처리 (0x00 = 성공, 0x11 = 구독 없음)
+                reason_codes.append(0x00 if topic_filter in self.subscriptions else 0x11)
+                self.server.unsubscribe(self.client_id, topic_filter)
+                self.remove_subscription(topic_filter)
+
+                logger.info(f"UNSUBSCRIBE: 토픽={topic_filter}")
+
             # UNSUBACK 응답 전송
-            self.send_unsuback(message_id)
-            
-            logger.info(f"UNSUBSCRIBE: 토픽={topic_filter}")
-            
+            self.send_unsuback(message_id, reason_codes)
+
         except Exception as e:
             logger.error(f"UNSUBSCRIBE 패킷 처리 오류: {e}")
+
+    def add_subscription(self, topic_filter: str):
+        """구독 목록에 필터 추가 (구독이 많은 브리지 클라이언트도 추가 비용이 일정하도록 집합으로 전환)"""
+        subscriptions = self.subscriptions
+        if isinstance(subscriptions, set):
+            subscriptions.add(topic_filter)
+        elif topic_filter not in subscriptions:
+            if len(subscriptions) >= SUBSCRIPTION_SET_THRESHOLD:
+                self.subscriptions = set(subscriptions)
+                self.subscriptions.add(topic_filter)
+            else:
+                self.subscriptions = subscriptions + (topic_filter,)
+    
+    def remove_subscription(self, topic_filter: str):
+        """구독 목록에서 필터 제거"""
+        subscriptions = self.subscriptions
+        if isinstance(subscriptions, set):
+            subscriptions.discard(topic_filter)
+        elif topic_filter in subscriptions:
+            self.subscriptions = tuple(
+                existing for existing in subscriptions if existing != topic_filter
+            )
     
     def handle_pingreq(self):
         """PINGREQ 패킷 처리"""
@@ -403,119 +1277,288 @@ class MQTTClient:
             logger.info("PINGREQ 처리 완료")
         except Exception as e:
             logger.error(f"PINGREQ 패킷 처리 오류: {e}")
-    
+
     def handle_disconnect(self):
         """DISCONNECT 패킷 처리"""
         logger.info(f"클라이언트 {self.client_id} 연결 해제")
         self.connected = False
-    
-    def send_connack(self):
+
+    def send_packet(self, packet):
+        """완성된 패킷 전송 (여러 스레드에서 동시에 쓰지 않도록 잠금)"""
+        with self.write_lock:
+            self.socket.sendall(packet)
+
+    def send_connack(self, assigned_client_id: Optional[str] = None, session_present: bool = False):
         """CONNACK 응답 전송"""
         try:
-            # CONNACK 패킷 구성
-            packet = bytearray()
-            packet.append(0x20)  # CONNACK 패킷 타입
-            packet.append(0x02)  # 나머지 길이
-            packet.append(0x00)  # 연결 플래그 (0 = 연결 수락)
-            packet.append(0x00)  # 반환 코드 (0 = 연결 수락)
-            
-            self.socket.send(packet)
+            if self.protocol_level == 5:
+                # 서버 기능/제한을 속성으로 알림
+                properties = (
+                    encode_property(PROPERTY_RECEIVE_MAXIMUM, self.server.receive_maximum)
+                    + encode_property(PROPERTY_TOPIC_ALIAS_MAXIMUM, self.server.topic_alias_maximum)
+                    + encode_property(PROPERTY_MAXIMUM_QOS, MAXIMUM_QOS)
+                    + encode_property(PROPERTY_MAXIMUM_PACKET_SIZE, self.server.maximum_packet_size)
+                    + encode_property(PROPERTY_RETAIN_AVAILABLE, 1)
+                    + encode_property(PROPERTY_SHARED_SUBSCRIPTION_AVAILABLE, 0)
+                )
+                if assigned_client_id:
+                    properties += encode_property(PROPERTY_ASSIGNED_CLIENT_IDENTIFIER, assigned_client_id)
+                properties = encode_properties(properties)
+
+                # CONNACK 패킷 (세션 존재 플래그, 이유 코드 0 = 성공, 속성)
+                packet = bytearray()
+                packet.append(0x20)  # CONNACK 패킷 타입
+                packet.extend(self.encode_remaining_length(2 + len(properties)))  # 나머지 길이
+                packet.append(0x01 if session_present else 0x00)
+                packet.append(0x00)
+                packet.extend(properties)
+                self.send_packet(packet)
+            elif session_present:
+                # CONNACK 패킷 (세션 존재 플래그 1, 반환 코드 0 = 연결 수락)
+                self.send_packet(CONNACK_SESSION_PRESENT)
+            else:
+                # CONNACK 패킷 (연결 플래그 0, 반환 코드 0 = 연결 수락)
+                self.send_packet(CONNACK_ACCEPTED)
             logger.info("CONNACK 전송 완료")
-            
+
         except Exception as e:
             logger.error(f"CONNACK 전송 오류: {e}")
-    
-    def send_suback(self, message_id: int, qos: int):
+
+    def send_puback(self, message_id: int):
+        """PUBACK 응답 전송"""
+        try:
+            # PUBACK 패킷 (MQTT 5에서도 이유 코드 0은 생략 가능)
+            self.send_packet(bytes((0x40, 0x02, message_id >> 8, message_id & 0xFF)))
+
+        except Exception as e:
+            logger.error(f"PUBACK 전송 오류: {e}")
+
+    def send_suback(self, message_id: int, granted_qos: bytes):
         """SUBACK 응답 전송"""
         try:
-            # SUBACK 패킷 구성
+            # SUBACK 패킷 구성 (MQTT 5는 빈 속성 블록 포함)
+            properties = b'\x00' if self.protocol_level == 5 else b''
             packet = bytearray()
             packet.append(0x90)  # SUBACK 패킷 타입
-            packet.append(0x03)  # 나머지 길이
+            packet.extend(self.encode_remaining_length(2 + len(properties) + len(granted_qos)))  # 나머지 길이
             packet.extend(message_id.to_bytes(2, 'big'))  # 메시지 ID
-            packet.append(qos)   # QoS
-            
-            self.socket.send(packet)
+            packet.extend(properties)
+            packet.extend(granted_qos)  # 토픽별 QoS
+
+            self.send_packet(packet)
             logger.info("SUBACK 전송 완료")
-            
+
         except Exception as e:
             logger.error(f"SUBACK 전송 오류: {e}")
-    
-    def send_unsuback(self, message_id: int):
+
+    def send_unsuback(self, message_id: int, reason_codes: bytes = b''):
         """UNSUBACK 응답 전송"""
         try:
-            # UNSUBACK 패킷 구성
+            # UNSUBACK 패킷 구성 (MQTT 5는 속성 블록과 토픽별 이유 코드 포함)
             packet = bytearray()
             packet.append(0xB0)  # UNSUBACK 패킷 타입
-            packet.append(0x02)  # 나머지 길이
-            packet.extend(message_id.to_bytes(2, 'big'))  # 메시지 ID
-            
-            self.socket.send(packet)
+            if self.protocol_level == 5:
+                packet.extend(self.encode_remaining_length(3 + len(reason_codes)))  # 나머지 길이
+                packet.extend(message_id.to_bytes(2, 'big'))  # 메시지 ID
+                packet.append(0x00)  # 속성 길이
+                packet.extend(reason_codes)
+            else:
+                packet.append(0x02)  # 나머지 길이
+                packet.extend(message_id.to_bytes(2, 'big'))  # 메시지 ID
+
+            self.send_packet(packet)
             logger.info("UNSUBACK 전송 완료")
-            
+
         except Exception as e:
             logger.error(f"UNSUBACK 전송 오류: {e}")
-    
+
     def send_pingresp(self):
         """PINGRESP 응답 전송"""
         try:
-            # PINGRESP 패킷 구성
-            packet = bytearray()
-            packet.append(0xD0)  # PINGRESP 패킷 타입
-            packet.append(0x00)  # 나머지 길이
-            
-            self.socket.send(packet)
+            # PINGRESP 패킷
+            self.send_packet(PINGRESP)
             logger.info("PINGRESP 전송 완료")
-            
+
         except Exception as e:
             logger.error(f"PINGRESP 전송 오류: {e}")
-    
-    def send_message(self, topic: str, message: str, qos: int = 0):
+
+    def send_message(self, topic, message, qos: int = 0):
         """메시지 전송"""
+        if not isinstance(topic, Topic):
+            topic = self.server.topics.get(topic)
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        self.deliver(Message(topic, message, qos))
+
+    def deliver(self, message: Message):
+        """라우팅된 메시지를 PUBLISH 패킷으로 전송"""
         try:
-            # PUBLISH 패킷 구성
-            packet = bytearray()
-            packet.append(0x30)  # PUBLISH 패킷 타입
-            
-            # 토픽 길이와 토픽 추가
-            topic_bytes = topic.encode('utf-8')
-            packet.extend(len(topic_bytes).to_bytes(2, 'big'))
-            packet.extend(topic_bytes)
-            
-            # 메시지 ID 추가 (QoS > 0인 경우)
-            if qos > 0:
-                message_id = 1  # 간단한 구현
-                packet.extend(message_id.to_bytes(2, 'big'))
-            
-            # 페이로드 추가
-            message_bytes = message.encode('utf-8')
-            packet.extend(message_bytes)
-            
-            # 나머지 길이 계산 및 추가
-            remaining_length = len(packet) - 1
-            packet[1] = remaining_length
-            
-            self.socket.send(packet)
-            logger.info(f"메시지 전송: {topic} -> {message}")
-            
+            # 만료된 메시지는 쓰기 작업을 하기 전에 버림
+            if message.expires_at is not None and message.expired(time.monotonic()):
+                logger.info(f"만료된 메시지 폐기: {message.topic.name}")
+                return
+
+            # 별칭 할당 순서가 전송 순서와 같아야 하므로 잠금 안에서 패킷 구성
+            with self.write_lock:
+                prepared = self.prepare_publish(message, time.monotonic())
+                if prepared is None:
+                    return
+
+                # 풀에서 빌린 버퍼에 PUBLISH 패킷 구성
+                buffer = self.server.buffer_pool.acquire(prepared[2] + 5)
+                try:
+                    offset = self.write_publish(buffer, 0, message, *prepared)
+                    trace = message.trace
+                    if trace is not None:
+                        trace.mark('enqueue')
+                    self.socket.sendall(memoryview(buffer)[:offset])
+                    if trace is not None:
+                        trace.mark('write')
+                finally:
+                    self.server.buffer_pool.release(buffer)
+
+            logger.info(f"메시지 전송: {message.topic.name} ({len(message.payload)} bytes)")
+
         except Exception as e:
             logger.error(f"메시지 전송 오류: {e}")
-    
+
+    def deliver_batch(self, messages):
+        """여러 메시지를 하나의 버퍼에 모아 적은 수의 쓰기로 전송"""
+        try:
+            sent = 0
+            with self.write_lock:
+                buffer = self.server.buffer_pool.acquire(BATCH_BUFFER_SIZE)
+                try:
+                    offset = 0
+                    for message in messages:
+                        # 만료된 메시지는 인코딩하지 않고 버림
+                        now = time.monotonic()
+                        if message.expired(now):
+                            continue
+                        prepared = self.prepare_publish(message, now)
+                        if prepared is None:
+                            continue
+                        size = prepared[2] + 5
+                        if offset + size > len(buffer):
+                            self.socket.sendall(memoryview(buffer)[:offset])
+                            offset = 0
+                        if size > len(buffer):
+                            # 배치 버퍼보다 큰 메시지는 단독으로 전송
+                            single = self.server.buffer_pool.acquire(size)
+                            try:
+                                end = self.write_publish(single, 0, message, *prepared)
+                                self.socket.sendall(memoryview(single)[:end])
+                            finally:
+                                self.server.buffer_pool.release(single)
+                        else:
+                            offset = self.write_publish(buffer, offset, message, *prepared)
+                        sent += 1
+                    if offset:
+                        self.socket.sendall(memoryview(buffer)[:offset])
+                finally:
+                    self.server.buffer_pool.release(buffer)
+
+            logger.info(f"메시지 일괄 전송: {self.client_id} ({sent}개)")
+
+        except Exception as e:
+            logger.error(f"메시지 일괄 전송 오류: {e}")
+
+    def prepare_publish(self, message: Message, now: float):
+        """PUBLISH 패킷 구성 준비 -> (토픽 바이트, 속성 바이트, 나머지 길이), 보내지 않을 메시지는 None
+
+        토픽 별칭을 할당하므로 쓰기 잠금 안에서 호출해야 한다.
+        """
+        topic = message.topic
+        topic_bytes = topic.encoded
+        properties = b''
+        if self.protocol_level == 5:
+            # 쓰기 잠금을 기다리는 동안 만료되었을 수 있음
+            if message.expired(now):
+                logger.info(f"만료된 메시지 폐기: {topic.name}")
+                return None
+            properties = message.v5_properties(now)
+
+            # 송신 토픽 별칭: 처음에는 토픽과 별칭을 함께, 이후에는 별칭만 전송
+            alias, established = self.outbound_alias(topic)
+            if alias is not None:
+                properties += bytes((PROPERTY_TOPIC_ALIAS, alias >> 8, alias & 0xFF))
+                if established:
+                    topic_bytes = b'\x00\x00'
+            properties = encode_properties(properties)
+
+        # 나머지 길이 계산 (토픽 + 메시지 ID + 속성 + 페이로드)
+        remaining_length = len(topic_bytes) + len(properties) + len(message.payload)
+        if message.qos > 0:
+            remaining_length += 2
+
+        # 클라이언트가 받을 수 없는 크기의 패킷은 보내지 않음
+        if self.maximum_packet_size and remaining_length + 5 > self.maximum_packet_size:
+            logger.info(f"최대 패킷 크기 초과로 메시지 폐기: {topic.name}")
+            return None
+
+        return topic_bytes, properties, remaining_length
+
+    def write_publish(self, buffer: bytearray, offset: int, message: Message,
+                      topic_bytes: bytes, properties: bytes, remaining_length: int) -> int:
+        """버퍼의 offset 위치에 PUBLISH 패킷을 쓰고 다음 오프셋 반환"""
+        qos = message.qos
+        payload = message.payload
+
+        buffer[offset] = 0x30 | (qos << 1) | message.retain  # PUBLISH 패킷 타입
+        offset = write_remaining_length(buffer, offset + 1, remaining_length)
+
+        # 길이 접두 토픽 추가
+        buffer[offset:offset + len(topic_bytes)] = topic_bytes
+        offset += len(topic_bytes)
+
+        # 메시지 ID 추가 (QoS > 0인 경우)
+        if qos > 0:
+            message_id = 1  # 간단한 구현
+            buffer[offset:offset + 2] = message_id.to_bytes(2, 'big')
+            offset += 2
+
+        # 속성 추가 (MQTT 5)
+        buffer[offset:offset + len(properties)] = properties
+        offset += len(properties)
+
+        # 페이로드 추가
+        buffer[offset:offset + len(payload)] = payload
+        return offset + len(payload)
+
+    def outbound_alias(self, topic: Topic):
+        """송신 토픽 별칭 조회/할당 -> (별칭 또는 None, 이미 알려진 별칭 여부)"""
+        if self.outbound_aliases is None:
+            if self.topic_alias_maximum == 0:
+                return None, False
+            self.outbound_aliases = {}
+        alias = self.outbound_aliases.get(topic.encoded)
+        if alias is not None:
+            return alias, True
+        # 별칭이 모두 사용 중이면 전체 토픽으로 전송
+        if len(self.outbound_aliases) >= self.topic_alias_maximum:
+            return None, False
+        alias = len(self.outbound_aliases) + 1
+        self.outbound_aliases[topic.encoded] = alias
+        return alias, False
+
     def encode_remaining_length(self, length: int):
         """나머지 길이 인코딩"""
         encoded = bytearray()
-        
-        while length > 0:
+
+        while True:
             byte = length % 128
             length = length // 128
-            
+
             if length > 0:
                 byte |= 0x80
-                
+
             encoded.append(byte)
-            
+
+            if length == 0:
+                break
+
         return encoded
-    
+
     def disconnect(self):
         """클라이언트 연결 종료"""
         try:
@@ -529,7 +1572,11 @@ def main():
     print("네트워크 MQTT 서버를 시작합니다...")
     print("종료하려면 Ctrl+C를 누르세요.")
     
-    server = MQTTServer(host='0.0.0.0', port=1883)
+    setup_logging()
+    # 종료할 때 영속 세션 구독과 보관 메시지를 저장하고 다음 시작 때 복원
+    server = MQTTServer(host='0.0.0.0', port=1883, snapshot_path='mqtt_server_snapshot.bin')
+    # 로컬 관리 명령 (python mqtt_admin.py)
+    server.add_listener(AdminListener())
     try:
         server.start()
     except KeyboardInterrupt:
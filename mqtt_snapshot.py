@@ -0,0 +1,115 @@
+import gc
+import logging
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# 스냅샷 헤더: 매직, 버전, 세션 수, 보관 메시지 수
+SNAPSHOT_MAGIC = b'MQSS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('>4sHII')
+# 세션: 클라이언트 ID 길이, 세션 만료 간격(초), 구독 필터 수 / 필터: 길이
+SESSION_HEADER = struct.Struct('>HII')
+FILTER_HEADER = struct.Struct('>H')
+# 보관 메시지: 남은 만료 시간(초, 없으면 -1), 레코드 길이
+RETAINED_HEADER = struct.Struct('>dI')
+
+# 만료되지 않는 세션 (MQTT 5 세션 만료 간격 최대값)
+NEVER_EXPIRES = 0xFFFFFFFF
+
+def write_snapshot(server, path: str):
+    """영속 세션의 구독 색인과 보관 메시지를 바이너리 스냅샷으로 저장
+
+    임시 파일에 쓴 뒤 교체하므로 저장 중에 종료되어도 이전 스냅샷이 남는다.
+    만료 시각은 monotonic 기준이라 남은 시간으로 바꿔 저장한다.
+    """
+    now = time.monotonic()
+    sessions = server.persistent_sessions()
+    retained = [message for message in list(server.retained.values()) if not message.expired(now)]
+
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sessions), len(retained))]
+    for client_id, expiry_interval, subscriptions in sessions:
+        encoded_id = client_id.encode('utf-8')
+        parts.append(SESSION_HEADER.pack(len(encoded_id), expiry_interval, len(subscriptions)))
+        parts.append(encoded_id)
+        for topic_filter in subscriptions:
+            encoded = topic_filter.encode('utf-8')
+            parts.append(FILTER_HEADER.pack(len(encoded)))
+            parts.append(encoded)
+    for message in retained:
+        record = message.to_record()
+        remaining = -1.0 if message.expires_at is None else message.expires_at - now
+        parts.append(RETAINED_HEADER.pack(remaining, len(record)))
+        parts.append(record)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(b''.join(parts))
+    os.replace(temporary, path)
+    logger.info(f"스냅샷 저장: {path} (세션 {len(sessions)}개, 보관 메시지 {len(retained)}개)")
+    return len(sessions), len(retained)
+
+def read_snapshot(server, path: str):
+    """스냅샷을 읽어 서버에 세션/구독/보관 메시지를 일괄 복원
+
+    복원된 세션은 오프라인 상태로 시작하며, 같은 ID로 다시 연결하면 세션이 이어진다.
+    객체를 대량으로 만드는 동안 순환 GC가 커지는 힙을 반복해서 훑지 않도록 잠시 끈다.
+    """
+    with open(path, 'rb') as snapshot:
+        data = snapshot.read()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return restore_snapshot(server, path, data)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def restore_snapshot(server, path: str, data: bytes):
+    """스냅샷 바이트 해석 및 복원 (read_snapshot에서 호출)"""
+    magic, version, session_count, retained_count = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"스냅샷 파일이 아닙니다: {path}")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"지원하지 않는 스냅샷 버전: {version}")
+
+    now = time.monotonic()
+    view = memoryview(data)
+    offset = SNAPSHOT_HEADER.size
+    sessions = []
+    entries = []
+    for _ in range(session_count):
+        id_length, expiry_interval, filter_count = SESSION_HEADER.unpack_from(data, offset)
+        offset += SESSION_HEADER.size
+        client_id = str(view[offset:offset + id_length], 'utf-8')
+        offset += id_length
+        subscriptions = []
+        for _ in range(filter_count):
+            (length,) = FILTER_HEADER.unpack_from(data, offset)
+            offset += FILTER_HEADER.size
+            subscriptions.append(sys.intern(str(view[offset:offset + length], 'utf-8')))
+            offset += length
+        expires_at = None if expiry_interval == NEVER_EXPIRES else now + expiry_interval
+        sessions.append((client_id, tuple(subscriptions), expires_at))
+        entries.extend((client_id, topic_filter) for topic_filter in subscriptions)
+
+    retained = []
+    for _ in range(retained_count):
+        remaining, length = RETAINED_HEADER.unpack_from(data, offset)
+        offset += RETAINED_HEADER.size
+        message = server.offline_store.decode_record(view[offset:offset + length])
+        offset += length
+        message.expires_at = None if remaining < 0 else now + remaining
+        message.retain = 1
+        retained.append(message)
+
+    server.offline_store.restore(sessions)
+    server.subscribe_many(entries)
+    for message in retained:
+        server.retained[message.topic.name] = message
+    logger.info(f"스냅샷 복원: {path} (세션 {len(sessions)}개, 구독 {len(entries)}개, "
+                f"보관 메시지 {len(retained)}개)")
+    return len(sessions), len(retained)
@@ -0,0 +1,188 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+# 메시지 처리 단계 (기록 순서)
+STAGES = ('read', 'decode', 'match', 'enqueue', 'write')
+
+class Trace:
+    """샘플링된 메시지 하나의 단계별 monotonic 타임스탬프 (ns)"""
+
+    __slots__ = ('tracer', 'started', 'stamps')
+
+    def __init__(self, tracer: 'Tracer'):
+        self.tracer = tracer
+        self.started = time.monotonic_ns()
+        self.stamps = []
+
+    def mark(self, stage: str):
+        """단계 완료 시각 기록 (여러 구독자에게 전달해도 첫 기록만 사용)"""
+        for recorded, _ in self.stamps:
+            if recorded == stage:
+                return
+        self.stamps.append((stage, time.monotonic_ns()))
+
+    def finish(self):
+        """단계별 소요 시간을 트레이서 통계에 반영"""
+        self.tracer.record(self)
+
+class Tracer:
+    """1/N 샘플링 메시지 트레이서
+
+    sample_rate가 0이면 꺼져 있고, 메시지당 비용은 정수 비교 한 번이다.
+    """
+
+    def __init__(self, sample_rate: int = 0, window: int = 4096):
+        self.sample_rate = sample_rate
+        self.window = window
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.traced = 0
+        # 단계별 최근 소요 시간 (ns)
+        self.durations: Dict[str, deque] = {}
+
+    def sample(self) -> Optional[Trace]:
+        """이번 메시지를 추적할지 결정 (N개마다 1개)"""
+        self.counter += 1
+        if self.counter < self.sample_rate:
+            return None
+        self.counter = 0
+        return Trace(self)
+
+    def set_rate(self, sample_rate: int):
+        """샘플링 비율 변경 (0 = 끄기)"""
+        self.sample_rate = max(0, sample_rate)
+        self.counter = 0
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.traced = 0
+
+    def record(self, trace: Trace):
+        """트레이스의 단계 간 간격을 통계에 추가"""
+        with self.lock:
+            previous = trace.started
+            for stage, stamp in trace.stamps:
+                self._add(stage, stamp - previous)
+                previous = stamp
+            self._add('total', previous - trace.started)
+            self.traced += 1
+
+    def _add(self, stage: str, duration: int):
+        durations = self.durations.get(stage)
+        if durations is None:
+            durations = self.durations[stage] = deque(maxlen=self.window)
+        durations.append(duration)
+
+    def stats(self) -> Dict[str, dict]:
+        """단계별 통계 (마이크로초)"""
+        result = {}
+        with self.lock:
+            snapshot = {stage: sorted(values) for stage, values in self.durations.items()}
+        for stage in STAGES + ('total',):
+            values = snapshot.get(stage)
+            if not values:
+                continue
+            result[stage] = {
+                'count': len(values),
+                'p50': values[len(values) // 2] / 1000,
+                'p99': values[min(len(values) - 1, len(values) * 99 // 100)] / 1000,
+                'max': values[-1] / 1000,
+            }
+        return result
+
+    def format_stats(self) -> str:
+        """관리 명령용 통계 문자열"""
+        lines = [f"샘플링: 1/{self.sample_rate}" if self.sample_rate else "샘플링: 꺼짐",
+                 f"추적한 메시지: {self.traced}",
+                 f"{'단계':<8} {'개수':>6} {'p50(us)':>10} {'p99(us)':>10} {'max(us)':>10}"]
+        for stage, values in self.stats().items():
+            lines.append(f"{stage:<8} {values['count']:>6} {values['p50']:>10.1f} "
+                         f"{values['p99']:>10.1f} {values['max']:>10.1f}")
+        return '\n'.join(lines)
+
+class SamplingProfiler:
+    """실행 중인 서버의 모든 스레드를 주기적으로 샘플링하는 프로파일러
+
+    cProfile은 호출한 스레드만 측정하므로, 스레드별 연결을 쓰는 서버에서는
+    sys._current_frames()로 모든 스레드의 스택을 모은다.
+    유휴 함수(ignore_codes)에서 대기 중인 스레드는 스택을 따라가지 않고 유휴로만 센다.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 32, ignore_codes=()):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.ignore_codes = set(ignore_codes)
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.running = False
+        self.thread = None
+        self.started_at = None
+        self.stopped_at = None
+
+    def start(self, interval: Optional[float] = None):
+        """샘플링 시작 (이전 결과 초기화)"""
+        if self.running:
+            return
+        if interval:
+            self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.running = True
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """샘플링 중지 (결과는 유지)"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.stopped_at = time.monotonic()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if frame.f_code in self.ignore_codes:
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def format_report(self, limit: int = 20) -> str:
+        """관리 명령용 보고서 (상위 함수와 flamegraph 호환 축약 스택)"""
+        elapsed = ((self.stopped_at or time.monotonic()) - self.started_at) if self.started_at else 0
+        lines = [f"상태: {'실행 중' if self.running else '중지'}, 경과 {elapsed:.1f}초, "
+                 f"샘플 {self.samples}개 (유휴 {self.idle}개), 간격 {self.interval * 1000:.1f}ms"]
+        if not self.samples:
+            return '\n'.join(lines)
+
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        lines.append("상위 함수 (스택 최상단):")
+        for function, count in leaves.most_common(limit):
+            lines.append(f"  {count * 100 / self.samples:5.1f}%  {function}")
+        lines.append("상위 스택 (축약 형식):")
+        for stack, count in self.stacks.most_common(limit):
+            lines.append(f"{stack} {count}")
+        return '\n'.join(lines)